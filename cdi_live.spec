@@ -25,10 +25,10 @@ exe = EXE(
     [],
     exclude_binaries=True,
     name='cdi_live',
-    debug="all",
+    debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -41,7 +41,7 @@ coll = COLLECT(
     a.binaries,
     a.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name='cdi_live',
 )
@@ -0,0 +1,176 @@
+"""
+Streaming accumulation of detector frames.
+
+Frames are added to a running float64 sum one at a time, so the memory needed is a few frames' worth no matter how many
+exposures are summed. Per-pixel variance (Welford's method, with the mean taken from the sum) and the per-pixel maximum
+come along for free, which is enough to flag hot pixels.
+"""
+import queue
+import threading
+
+import numpy as np
+
+import src.readers as readers
+
+
+def iter_frames(filepaths, reader=readers.open_frames, prefetch=2):
+    """
+    Yield every frame of every file in order, while the next ones are read on a background thread.
+
+    `reader` returns the sequence of frames in a file. Memory-mapped frames are passed through as lazy views; anything
+    else is decoded on the reader thread. At most `prefetch` frames are waiting at any time, which bounds the memory
+    used by the read-ahead.
+    """
+    frames = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for filepath in filepaths:
+                for frame in reader(filepath):
+                    if stop.is_set():
+                        return
+                    put(frame if isinstance(frame, np.ndarray) else np.asarray(frame))
+        except Exception as err:
+            put(err)
+        put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = frames.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class FrameAccumulator:
+    """
+    Running per-pixel statistics of a stream of frames. Only the sum, the sum of squared deviations and the maximum are
+    kept; the mean is derived from the sum, and the working buffers of each update only live as long as it does.
+    """
+    def __init__(self):
+        self.n_frames = 0
+        self.sum = None
+        self._m2 = None
+        self.max = None
+
+    @property
+    def mean(self):
+        return None if self.sum is None else self.sum / self.n_frames
+
+    def add(self, frame, scratch=None):
+        """Add one frame. Two scratch arrays of its shape can be passed in, to reuse them from frame to frame."""
+        frame = np.asarray(frame)
+        if self.sum is None:
+            self.sum = np.zeros(frame.shape)
+            self._m2 = np.zeros(frame.shape)
+            self.max = np.full(frame.shape, -np.inf)
+        elif frame.shape != self.sum.shape:
+            raise ValueError(f"Frame shape {frame.shape} doesn't match the accumulated shape {self.sum.shape}")
+        np.maximum(self.max, frame, out=self.max)
+        if self.n_frames == 0:
+            # The first frame is its own mean, so it deviates from it by nothing
+            self.sum += frame
+            self.n_frames = 1
+            return
+        delta, deviation = (np.empty(frame.shape), np.empty(frame.shape)) if scratch is None else scratch
+        # Welford's update, with the means taken from the sums: m2 += (x - mean_before) * (x - mean_after)
+        np.divide(self.sum, self.n_frames, out=delta)
+        np.subtract(frame, delta, out=delta)
+        self.sum += frame
+        self.n_frames += 1
+        np.divide(self.sum, self.n_frames, out=deviation)
+        np.subtract(frame, deviation, out=deviation)
+        deviation *= delta
+        self._m2 += deviation
+
+    def merge(self, other):
+        """Fold in the frames summed by another accumulator, as if they had been added here one by one."""
+        if other.n_frames == 0:
+            return self
+        if self.n_frames == 0:
+            for name in ["sum", "_m2", "max"]:
+                setattr(self, name, getattr(other, name).copy())
+            self.n_frames = other.n_frames
+            return self
+        if other.sum.shape != self.sum.shape:
+            raise ValueError(f"Frame shape {other.sum.shape} doesn't match the accumulated shape {self.sum.shape}")
+        # Chan et al.'s pairwise update: delta = mean_b - mean_a; m2 += m2_b + delta^2 n_a n_b / n
+        n_a, n_b = self.n_frames, other.n_frames
+        n = n_a + n_b
+        delta = other.sum / n_b
+        delta -= self.sum / n_a
+        np.square(delta, out=delta)
+        delta *= n_a * n_b / n
+        self._m2 += delta
+        self._m2 += other._m2
+        self.sum += other.sum
+        np.maximum(self.max, other.max, out=self.max)
+        self.n_frames = n
+        return self
+
+    def add_files(self, filepaths, reader=readers.open_frames, prefetch=2):
+        scratch = None
+        for frame in iter_frames(filepaths, reader, prefetch):
+            frame = np.asarray(frame)
+            if scratch is None or scratch[0].shape != frame.shape:
+                scratch = np.empty(frame.shape), np.empty(frame.shape)
+            self.add(frame, scratch)
+        return self
+
+    @property
+    def variance(self):
+        """Per-pixel sample variance across the accumulated frames."""
+        if self.n_frames < 2:
+            return np.zeros_like(self.sum)
+        return self._m2 / (self.n_frames - 1)
+
+    def hot_pixels(self, n_sigma=5.0, ndim=2):
+        """
+        Flag pixels whose mean stands out from their neighbors by more than n_sigma (robust) standard deviations.
+
+        The frames have ndim spatial axes (3 for volumes), plus optionally a last axis of color channels, which are
+        summed to grayscale first. Returns a boolean mask over the spatial axes.
+        """
+        import scipy.ndimage as ndi
+        mean = self.mean
+        if mean.ndim == ndim + 1:
+            mean = mean.sum(axis=-1)
+        elif mean.ndim != ndim:
+            raise ValueError(f"Expected {ndim}D frames (with or without color channels), got shape {mean.shape}")
+        local = ndi.median_filter(mean, size=3)
+        excess = mean - local
+        # The noise floor is the larger of the image-wide (robust) spread and the local shot noise of the mean.
+        spread = 1.4826 * np.median(np.abs(excess - np.median(excess)))
+        shot_noise = np.sqrt(np.maximum(local, 1) / self.n_frames)
+        return excess > n_sigma * np.maximum(spread, shot_noise)
+
+    def stats(self, ndim=2):
+        if self.n_frames == 0:
+            return {"n_frames": 0}
+        return {
+            "n_frames": self.n_frames,
+            "mean_counts": float(self.mean.mean()),
+            "mean_variance": float(self.variance.mean()),
+            "max_counts": float(self.max.max()),
+            "n_hot_pixels": int(np.count_nonzero(self.hot_pixels(ndim=ndim))),
+        }
+
+
+def accumulate(filepaths, reader=readers.open_frames, prefetch=2):
+    """Sum all of the frames in a list of files, holding no more than a few frames in memory at once."""
+    return FrameAccumulator().add_files(filepaths, reader, prefetch)
@@ -0,0 +1,209 @@
+"""
+Reproducible throughput benchmarks for the solver and the preprocessing steps.
+
+Every case is timed over several repeats (reporting the median and interquartile range), then run once more under
+tracemalloc to get its peak memory. Results are written to JSON so that runs from different commits can be compared.
+
+With --startup, cold starts of the GUI are timed instead, in fresh interpreters, and checked against the budget in
+src.startup.BUDGET_S. Where the GUI can't be shown (e.g. without a display), only its imports are timed.
+
+Usage:
+    python -m src.benchmark --output bench.json
+    python -m src.benchmark --sizes 256 512 -k solver --compare bench.json
+    python -m src.benchmark --startup
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import scipy
+
+import src.diffraction as diffraction
+import src.phasing as phasing
+import src.readers as readers
+import src.startup as startup
+import src.support as support
+import src.utils as ut
+
+
+SIZES = [256, 512, 1024, 2048]
+EXAMPLES = sorted((Path(__file__).parents[1] / "example_data").glob("ideal_*.tif"))
+PREPROCESS_OPTIONS = {
+    "none": {},
+    "median_bkgd": {"sub_bkgd": True},
+    "bkgd_frame": {"sub_bkgd": True},
+    "binning": {"do_binning": True, "binning": 2},
+    "cropping": {"do_cropping": True, "cropping": 0.5},
+    "gaussian": {"do_gaussian": True, "sigma": 2.0},
+    "threshold": {"do_thresh": True, "thresh": 0.5},
+    "vignette": {"do_vign": True, "vsigma": 0.5},
+}
+
+
+def synthetic_diffraction(size, seed=0):
+    """The diffraction amplitude of a random binary aperture, roughly 2x oversampled."""
+    rng = np.random.default_rng(seed)
+    obj = np.zeros((size, size))
+    quarter = size // 4
+    obj[quarter:-quarter, quarter:-quarter] = rng.random((size - 2*quarter, size - 2*quarter)) > 0.7
+    return np.abs(ut.fft(obj))
+
+
+def synthetic_frame(shape, seed=0):
+    """A raw detector frame: Poisson counts from an off-center diffraction pattern plus a dark level."""
+    rng = np.random.default_rng(seed)
+    size = max(shape)
+    pattern = synthetic_diffraction(size, seed)**2
+    pattern = np.roll(pattern, (size // 10, -size // 12), axis=(0, 1))[:shape[0], :shape[1]]
+    return rng.poisson(1000 * pattern / pattern.max() + 10).astype(np.float32)
+
+
+def measure(func, repeat=7, number=1):
+    func()  # warm up caches, FFT plans, etc.
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - tic) / number)
+    # Tracing slows everything down, so memory is measured separately from the timing.
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {"median_s": median, "iqr_s": q3 - q1, "per_s": 1 / median, "peak_bytes": int(peak), "repeat": repeat,
+            "number": number}
+
+
+def cases(sizes):
+    """Yield (name, func, number) for every benchmark case. The data for each case is built once, up front."""
+    for size in sizes:
+        number = max(1, 2**20 // size**2 * 4)
+        solver = phasing.Solver(synthetic_diffraction(size), seed=0)
+        yield f"solver.hio_iteration[{size}]", solver.hio_iteration, number
+        yield f"solver.er_iteration[{size}]", solver.er_iteration, number
+        sup = support.Support2D(size)
+        image = solver.ds_image
+        yield f"support.shrinkwrap[{size}]", lambda sup=sup, image=image: sup.shrinkwrap(image, 2.0, 0.2), number
+
+    data = diffraction.LoadData()
+    for name, kwargs in PREPROCESS_OPTIONS.items():
+        def func(data=data, name=name, kwargs=kwargs):
+            # Time the full pipeline rather than a cache hit
+            data.clear_cache()
+            data.bkgd = 0.1 * data.image if name == "bkgd_frame" else None
+            data.preprocess(**kwargs)
+        yield f"preprocess[{name}]", func, 5
+
+    for filepath in EXAMPLES:
+        frame = readers.read_frame(filepath)
+        yield f"im_convert[{filepath.name}]", lambda frame=frame: diffraction.im_convert(frame), 3
+    for shape in [(1024, 1024), (2048, 1536), (4096, 4096)]:
+        frame = synthetic_frame(shape)
+        yield f"im_convert[synthetic {shape[0]}x{shape[1]}]", lambda frame=frame: diffraction.im_convert(frame), 1
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "fft_backend": ut.FFT_BACKEND,
+        "fft_workers": ut.FFT_WORKERS,
+        "precision": ut.PRECISION,
+    }
+
+
+def run(sizes=SIZES, pattern=None, repeat=7, verbose=True):
+    results = {}
+    for name, func, number in cases(sizes):
+        if pattern is not None and pattern not in name:
+            continue
+        results[name] = measure(func, repeat, number)
+        if verbose:
+            r = results[name]
+            print(f"{name:<40} {r['median_s'] * 1e3:10.3f} ms  ± {r['iqr_s'] * 1e3:8.3f} ms (IQR)  "
+                  f"{r['per_s']:9.1f} /s  {r['peak_bytes'] / 2**20:8.1f} MiB peak")
+    return {"meta": metadata(), "cases": results}
+
+
+def run_startup(repeat=5, verbose=True):
+    """Time the milestones of repeated cold starts of the GUI (see src.startup), and check them against the budget."""
+    runs = [startup.measure_gui()]
+    if runs[0] is None:
+        if verbose:
+            print("The GUI can't start here (no display?), so only the imports are timed.")
+        runs = [startup.measure_import() for _ in range(repeat)]
+    else:
+        runs += [startup.measure_gui() for _ in range(repeat - 1)]
+    results = {}
+    for name in runs[0]["times"]:
+        times = [run["times"][name] for run in runs if run is not None and name in run["times"]]
+        q1, median, q3 = np.percentile(times, [25, 50, 75])
+        budget = startup.BUDGET_S.get(name)
+        results[f"startup.{name}"] = {"median_s": median, "iqr_s": q3 - q1, "budget_s": budget,
+                                      "within_budget": budget is None or bool(median <= budget),
+                                      "imported": runs[0]["imported"][name], "repeat": len(times)}
+    if verbose:
+        for name, r in results.items():
+            budget = "" if r["budget_s"] is None else \
+                f"  budget {r['budget_s']:.1f} s  {'ok' if r['within_budget'] else 'OVER'}"
+            print(f"{name:<40} {r['median_s'] * 1e3:10.1f} ms  ± {r['iqr_s'] * 1e3:8.1f} ms (IQR){budget}")
+        milestone = "window" if "startup.window" in results else "imports"
+        imported = results[f"startup.{milestone}"]["imported"]
+        print(f"\nImported by the {milestone} milestone: {', '.join(imported) or 'none'} "
+              f"(of {', '.join(startup.DEFERRED)})")
+        print("Slowest imports of src.cdi_live:")
+        for module, seconds in startup.import_profile():
+            print(f"  {module:<38} {seconds * 1e3:10.1f} ms")
+    return {"meta": metadata(), "cases": results}
+
+
+def compare(results, baseline):
+    """Print the speedup of each case relative to a previous run."""
+    print(f"\nCompared to {baseline['meta'].get('commit')} ({baseline['meta'].get('date')}):")
+    for name, r in results["cases"].items():
+        if name in baseline["cases"]:
+            speedup = baseline["cases"][name]["median_s"] / r["median_s"]
+            print(f"{name:<40} {speedup:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark solver and preprocessing throughput.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("-k", dest="pattern", default=None, help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("-p", "--precision", choices=list(ut.PRECISIONS), default=ut.PRECISION)
+    parser.add_argument("-o", "--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="JSON file from a previous run to compare against")
+    parser.add_argument("--startup", action="store_true", help="time cold starts of the GUI against their budget")
+    args = parser.parse_args()
+
+    ut.set_precision(args.precision)
+    if args.startup:
+        results = run_startup(args.repeat)
+    else:
+        results = run(args.sizes, args.pattern, args.repeat)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.startup and not all(r["within_budget"] for r in results["cases"].values()):
+        raise SystemExit("Startup is over budget")
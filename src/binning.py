@@ -0,0 +1,121 @@
+"""
+Area binning of detector frames.
+
+Unlike spline zooming, binning adds up the photons that fell in each output pixel, so counts are conserved and no
+ringing or negative values are introduced:
+    * integer factors sum square blocks through a reshape, which is a single pass over the data,
+    * non-integer factors average over each output pixel's footprint (its overlap with the input pixels), which is
+      antialiased by construction and applied as sparse matrix products, one per axis.
+
+Edges that don't fill a whole block are handled explicitly, see EDGES.
+"""
+import numpy as np
+
+
+# What to do with the pixels left over when a side isn't a multiple of the binning factor:
+#   "trim"      drop them (the output has n // factor pixels per side)
+#   "partial"   sum them into a smaller last block (n // factor + 1 pixels per side, counts are conserved)
+#   "pad"       treat the missing pixels as zeros, which is the same as "partial" for sums
+EDGES = ["trim", "partial", "pad"]
+INTEGER_TOLERANCE = 1e-6
+
+
+def _factors(factor, ndim):
+    factors = np.broadcast_to(factor, (ndim,))
+    if np.any(factors < 1) or np.any(factors != np.round(factors)):
+        raise ValueError(f"Block binning needs integer factors >= 1, not {factor}")
+    return factors.astype(int)
+
+
+def block_sum(image, factor, edge="trim"):
+    """Sum non-overlapping blocks of `factor` pixels along every axis (factor can be a number or one per axis)."""
+    if edge not in EDGES:
+        raise ValueError(f"Unknown edge mode '{edge}' (available: {EDGES})")
+    image = np.asarray(image)
+    factors = _factors(factor, image.ndim)
+    if np.all(factors == 1):
+        return image.copy()
+    if edge == "trim":
+        image = image[tuple(slice(0, n // f * f) for n, f in zip(image.shape, factors))]
+    elif any(n % f for n, f in zip(image.shape, factors)):
+        # Leftover pixels form a partial last block; zero-padding it out to a whole block leaves its sum unchanged.
+        image = np.pad(image, [(0, -n % f) for n, f in zip(image.shape, factors)])
+    shape = [d for n, f in zip(image.shape, factors) for d in (n // f, f)]
+    return image.reshape(shape).sum(axis=tuple(range(1, 2 * image.ndim, 2)))
+
+
+def block_mean(image, factor, edge="trim"):
+    """Average non-overlapping blocks; partial blocks at the edges are averaged over the pixels they actually hold."""
+    image = np.asarray(image)
+    factors = _factors(factor, image.ndim)
+    binned = block_sum(image, factors, edge)
+    if edge != "partial":
+        return binned / np.prod(factors)
+    counts = np.ones(1)
+    for n, f in zip(image.shape, factors):
+        starts = np.arange(0, n, f)
+        counts = np.multiply.outer(counts, np.minimum(starts + f, n) - starts)
+    return binned / counts.reshape(binned.shape)
+
+
+def _area_matrix(n_in, n_out):
+    """Sparse (n_out, n_in) matrix of the overlap between each output pixel's footprint and the input pixels."""
+    import scipy.sparse as sparse  # slow to import, and integer factors never need it
+    scale = n_in / n_out
+    starts = np.arange(n_out) * scale
+    first = np.floor(starts).astype(int)
+    width = int(np.ceil(scale)) + 1
+    cols = first[:, None] + np.arange(width)
+    lo = np.maximum(cols, starts[:, None])
+    hi = np.minimum(cols + 1, starts[:, None] + scale)
+    weights = np.clip(hi - lo, 0, None)
+    valid = (cols < n_in) & (weights > 0)
+    rows = np.broadcast_to(np.arange(n_out)[:, None], cols.shape)
+    return sparse.csr_matrix((weights[valid], (rows[valid], cols[valid])), shape=(n_out, n_in))
+
+
+def area_sum(image, shape):
+    """Resample an image to `shape` by summing over each output pixel's area. Works for any (non-integer) factor."""
+    image = np.asarray(image)
+    dtype = np.result_type(image.dtype, np.float32)
+    for axis, n_out in enumerate(shape):
+        moved = np.moveaxis(image, axis, 0)
+        summed = _area_matrix(moved.shape[0], n_out) @ moved.reshape(moved.shape[0], -1)
+        image = np.moveaxis(np.asarray(summed).reshape((n_out,) + moved.shape[1:]), 0, axis)
+    return np.asarray(image, dtype=dtype)
+
+
+def area_mean(image, shape):
+    scale = np.prod(np.array(np.shape(image)) / np.array(shape))
+    return area_sum(image, shape) / scale
+
+
+def _is_integer(factor):
+    return np.all(np.abs(factor - np.round(factor)) < INTEGER_TOLERANCE)
+
+
+def bin_image(image, factor, edge="trim", mean=False):
+    """
+    Bin an image down by `factor` (one number, or one per axis), picking the method automatically.
+
+    Integer factors use block binning, with `edge` deciding what happens to leftover pixels. Other factors use area
+    resampling to round(n / factor) pixels per side. Sums are returned (conserving counts), or averages if mean=True.
+    """
+    image = np.asarray(image)
+    factors = np.broadcast_to(np.asarray(factor, dtype=float), (image.ndim,))
+    if np.any(factors < 1):
+        raise ValueError(f"Binning factors must be >= 1, not {factor}")
+    if _is_integer(factors):
+        factors = np.round(factors).astype(int)
+        return (block_mean if mean else block_sum)(image, factors, edge)
+    shape = tuple(max(1, int(round(n / f))) for n, f in zip(image.shape, factors))
+    return (area_mean if mean else area_sum)(image, shape)
+
+
+def resize(image, shape, mean=False):
+    """Bin an image down to exactly `shape`: block binning if the sides divide evenly, area resampling otherwise."""
+    image = np.asarray(image)
+    if all(n % m == 0 for n, m in zip(image.shape, shape)):
+        factors = [n // m for n, m in zip(image.shape, shape)]
+        return (block_mean if mean else block_sum)(image, factors)
+    return (area_mean if mean else area_sum)(image, shape)
@@ -0,0 +1,105 @@
+"""
+On-disk cache of reconstructions, so that returning to a dataset and preprocessing that were already phased picks up
+the result instead of starting over from a random phase.
+
+Entries are checkpoint bundles (see src.checkpoint), which hold the preprocessed diffraction along with the full solver
+state, so a cached reconstruction can be continued exactly. They're addressed by a hash of the preprocessed data's key
+(LoadData.last_key: the raw data's content hash plus every preprocessing parameter) and of the parameters of the
+reconstruction itself (recipe, seed, ...). The least recently used entries are deleted once the cache outgrows its
+size cap.
+"""
+import hashlib
+import json
+import os
+import zipfile
+from pathlib import Path
+
+import src.checkpoint as checkpoint
+import src.export as export
+
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "cdi_live"
+MAX_BYTES = 2 * 2**30
+
+
+def result_key(data_key, **params):
+    """The address of a reconstruction of preprocessed data (by LoadData.last_key) with the given parameters."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(data_key).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    A directory of reconstructions, capped at max_bytes. The modification time of each entry is its last use, so the
+    eviction order survives restarts.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def entries(self):
+        """The (path, size in bytes) of every entry, oldest use first."""
+        found = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another thread or process in the meantime
+            found.append((stat.st_mtime_ns, path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(found)]
+
+    @property
+    def size(self):
+        return sum(size for _, size in self.entries())
+
+    def __contains__(self, key):
+        return self.path(key).is_file()
+
+    def get(self, key):
+        """Restore a cached reconstruction. Returns (solver, params), or None if there's no (readable) entry."""
+        path = self.path(key)
+        if not path.is_file():
+            return None
+        try:
+            result = checkpoint.load(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # A damaged entry is worthless, so it goes, rather than failing the same way every time
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, bundle):
+        """
+        Store a checkpoint bundle (checkpoint.state_bundle) under the key, then evict old entries to make room. The
+        write is atomic, so this can run on a background thread, e.g. on an export.Exporter's pool.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = export.write_bundle(self.path(key), bundle, compress=False)
+        self.evict()
+        return path
+
+    def store(self, key, solver, params=None):
+        return self.put(key, checkpoint.state_bundle(solver, params))
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self):
+        for path, _ in self.entries():
+            path.unlink(missing_ok=True)
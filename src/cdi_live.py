@@ -6,20 +6,33 @@ from pathlib import Path
 import sys
 sys.path.append(f"{Path(__file__).parents[1]}")
 
+from src.startup import Milestones
+STARTUP = Milestones()  # before the imports below, so that they're timed as well
+
+import argparse
+import json
+import os
+import tempfile
 import time
 import tkinter as tk
 from tkinter.messagebox import showinfo
-from tkinter.filedialog import askdirectory
+from tkinter.filedialog import askdirectory, askopenfilename
 import tkinter.ttk as ttk
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.patches import Rectangle
 
+# Only modules that are quick to import are imported up front; matplotlib and the slower parts of scipy are imported
+# once the window is on screen (see App.__init__), so that it appears as soon as possible.
 import src.phasing as phasing
 import src.diffraction as diffraction
 import src.utils as ut
+import src.worker as worker
+import src.watch as watch
+import src.export as export
+import src.checkpoint as checkpoint
+import src.display as display
+import src.cache as cache
+STARTUP.mark("imports")
 
 
 DATA = 0
@@ -27,12 +40,45 @@ MANUAL = 1
 AUTO = 2
 
 UNITS = {power: unit for power, unit in zip([-4, -3, -2, -1, 0], ["pm", "nm", "μm", "mm", "m"])}
+DISPLAY_FPS = 20
+PREPROCESS_DELAY_MS = 150  # bursts of changes to the preprocessing controls are coalesced over this interval
+WATCH_POLL_MS = 250
+AUTOSAVE = Path(tempfile.gettempdir()) / "cdi_live_autosave.npz"
+AUTOSAVE_EVERY = 500  # iterations
+LOAD_POLL_MS = 50
+STARTUP_REPORT = "CDI_LIVE_STARTUP_REPORT"  # set this environment variable for the same as --startup-report
+
+
+def load_example(params):
+    """Load and preprocess the example data. This runs off the GUI thread, so the parameters are read beforehand."""
+    data = diffraction.LoadData()
+    data.preprocess(**params)  # cached, so that the first App.preprocess() only looks it up
+    return data
 
 
 class App:
-    def __init__(self):
-        self.data = diffraction.LoadData()
-        self.solver = phasing.Solver(self.data.preprocess())
+    def __init__(self, fps=DISPLAY_FPS, startup_report=None, exit_when_ready=False):
+        # The data are loaded, and the first reconstruction set up, in the background once the window is up.
+        self.data = None
+        self.solver = None
+        self.startup_report = startup_report  # None, "text" or "json"
+        self.exit_when_ready = exit_when_ready
+        # Reconstructions are cached on disk per dataset and preprocessing, so going back to one picks it up again.
+        # The key is left unset until the window is up, when preprocess() looks the data up in the cache.
+        self.cache = cache.ResultCache()
+        self.solver_key = None
+        self.solver_data = {}  # data_params() of the data the solver was set up for
+        # False while the solver's diffraction isn't the data under solver_key (after a restore), so it isn't cached
+        self.cache_solver = False
+        self.cached_iterations = 0
+        # The solver iterates on its own thread while running; the display is refreshed at a fixed frame rate.
+        self.worker = worker.SolverThread()
+        self.worker.start()
+        self.exporter = export.Exporter()
+        # The running reconstruction is checkpointed every so often, and before anything replaces it.
+        self.autosave = checkpoint.AutoCheckpoint(AUTOSAVE, AUTOSAVE_EVERY, self.exporter)
+        self.worker.autosave = self.autosave
+        self.frame_ms = int(1000 / fps)
 
         self.root = tk.Tk()
         self.root.title("Interactive Phase Retrieval (v 0.6)")
@@ -50,11 +96,16 @@ class App:
         data_tab = ttk.Frame(self.control_panel)
 
         r = 0
-        ttk.Button(data_tab, text="Load data", command=self.load_data).grid(row=r, column=0, columnspan=3,
-                                                                              **btn_kwargs)
+        load_button = ttk.Button(data_tab, text="Load data", command=self.load_data)
+        load_button.grid(row=r, column=0, columnspan=3, **btn_kwargs)
         r += 1
-        ttk.Button(data_tab, text="Load background", command=self.load_bkgd).grid(row=r, column=0, columnspan=3,
-                                                                                  **btn_kwargs)
+        bkgd_button = ttk.Button(data_tab, text="Load background", command=self.load_bkgd)
+        bkgd_button.grid(row=r, column=0, columnspan=3, **btn_kwargs)
+        r += 1
+        self.watcher = None
+        self.watch_button = ttk.Button(data_tab, text="Watch folder", command=self.toggle_watch)
+        self.watch_button.grid(row=r, column=0, columnspan=3, **btn_kwargs)
+        self.data_buttons = [load_button, bkgd_button, self.watch_button]  # disabled until the example data are in
         r += 1
         self.det_pitch = tk.DoubleVar(value=5.5)
         self.det_dist = tk.DoubleVar(value=100)
@@ -126,7 +177,8 @@ class App:
 
         for var in [self.pre_bkgd, self.pre_bin_q, self.pre_bin_factor, self.pre_crop_q, self.pre_crop_factor,
                     self.pre_gauss_q, self.pre_gauss_sigma, self.pre_threshold_q, self.pre_threshold_val]:
-            var.trace("w", self.preprocess)
+            var.trace("w", self.schedule_preprocess)
+        self._preprocess_job = None
 
         # Manual controls #############################################################################################
         manual_tab = ttk.Frame(self.control_panel)
@@ -185,6 +237,15 @@ class App:
         self.save_msg = True
         ttk.Button(live_tab, text="Save results", command=self.save_result).grid(row=r, column=0, columnspan=3,
                                                                                  **btn_kwargs)
+        r += 1
+        ttk.Button(live_tab, text="Restore checkpoint", command=self.restore).grid(row=r, column=0, columnspan=3,
+                                                                                  **btn_kwargs)
+        r += 1
+        ttk.Label(live_tab, text="Algorithm").grid(row=r, column=0, sticky=tk.E)
+        self.algorithm = tk.StringVar(value="hio")
+        self.algorithm_box = ttk.Combobox(live_tab, textvariable=self.algorithm, values=sorted(phasing.ALGORITHMS),
+                                          state="readonly", width=6)
+        self.algorithm_box.grid(row=r, column=1, **btn_kwargs)
 
         # Parameter controls ##########################################################################################
         self.sw_sigma = tk.DoubleVar(value=2.0)
@@ -218,39 +279,95 @@ class App:
         self.control_panel.add(data_tab, text="Data")
         self.control_panel.add(manual_tab, text="Manual")
         self.control_panel.add(live_tab, text="Auto")
-
-        # Finally, make the object itself. Start with random shapes.
-        impad = 2
+        # There's nothing to reconstruct until the data are loaded
+        for tab in [MANUAL, AUTO]:
+            self.control_panel.tab(tab, state="disabled")
+        for button in self.data_buttons:
+            button["state"] = "disabled"
+
+        # Finally, make room for the images. They're drawn once the window is up.
+        self.impad = 2
         self.im_size = 500
-        self.images = [np.abs(self.solver.fs_image), np.angle(self.solver.fs_image)]
+        self.placeholders = []
+        for col, label in zip([0, 2], ["Amplitude", "Phase"]):
+            ttk.Label(self.root, text=label, font=("Arial", 20), justify=tk.CENTER).grid(row=0, column=col)
+            placeholder = tk.Frame(self.root, width=self.im_size, height=self.im_size)
+            placeholder.grid(row=1, column=col, padx=self.impad, pady=self.impad)
+            self.placeholders.append(placeholder)
+
+        # Images are drawn from small buffers matched to the canvas size rather than from the full arrays.
+        self.display = display.DisplayBuffers(self.im_size)
+        self.control_panel.bind("<<NotebookTabChanged>>", self.update_images)
+
+        self.clock = time.perf_counter()
+        self.root.update()
+        STARTUP.mark("window")
+        # The example data load while matplotlib is imported and the canvases are built
+        loading = self.exporter.pool.submit(load_example, self.preprocess_params())
+        self.build_canvases()
+        STARTUP.mark("canvases")
+        self.root.after(LOAD_POLL_MS, self.check_loaded, loading)
+        # showinfo("Welcome", "Welcome to Interactive CDI!\n\n"
+        #                     "If you like this project, please give it a star on GitHub.")
+        self.root.mainloop()
+
+    def build_canvases(self):
+        """Replace the placeholders with the image canvases (with blank images until the data are in)."""
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Rectangle
+
         self.axes = []
         self.image_canvas = []
         self.scale_bars = []
         self.scale_bars_text = []
-
-        for col, label, image, cmap in zip([0, 2], ["Amplitude", "Phase"], self.images, ["gray", "hsv"]):
-            ttk.Label(self.root, text=label, font=("Arial", 20), justify=tk.CENTER).grid(row=0, column=col)
-            fig = plt.figure(figsize=(1, 1), dpi=self.im_size)
+        for col, placeholder, cmap in zip([0, 2], self.placeholders, ["gray", "hsv"]):
+            fig = Figure(figsize=(1, 1), dpi=self.im_size)
             ax = fig.add_subplot(xticks=[], yticks=[])
-            axim = ax.imshow(image, cmap=cmap, extent=(0, 1, 0, 1), interpolation_stage='rgba')
-            fig.tight_layout(pad=0)
+            axim = ax.imshow(np.zeros((2, 2)), cmap=cmap, extent=(0, 1, 0, 1), interpolation_stage='rgba')
             cvs = FigureCanvasTkAgg(fig, master=self.root)
-            cvs.get_tk_widget().grid(row=1, column=col, padx=impad, pady=impad)
+            fig.tight_layout(pad=0)
+            placeholder.destroy()
+            cvs.get_tk_widget().grid(row=1, column=col, padx=self.impad, pady=self.impad)
             bar = Rectangle((0.04, 0.04), 0.35, 0.06, color='white')
             ax.add_patch(bar)
             bar_text = ax.text(0.05, 0.05, "Hello!", fontsize=4)
+            cvs.draw()  # blitting needs a full draw to start from
             for container, thing in zip([self.axes, self.image_canvas, self.scale_bars, self.scale_bars_text],
                                         [axim, cvs, bar, bar_text]):
                 container.append(thing)
-
-        self.control_panel.bind("<<NotebookTabChanged>>", self.update_images)
-
-        self.clock = time.perf_counter()
-        self.preprocess()
-        self.root.update()
-        # showinfo("Welcome", "Welcome to Interactive CDI!\n\n"
-        #                     "If you like this project, please give it a star on GitHub.")
-        self.root.mainloop()
+        self.placeholders = []
+
+    def check_loaded(self, loading):
+        """Once the example data are loaded, set up the first reconstruction and unlock the controls."""
+        if not loading.done():
+            self.root.after(LOAD_POLL_MS, self.check_loaded, loading)
+            return
+        # Whatever goes wrong, the app starts out empty instead, with the data buttons enabled to load something else
+        try:
+            self.data = loading.result()
+        except Exception as err:
+            self.data = diffraction.LoadData(None)
+            showinfo("Error", f"Couldn't load the example data:\n\n{err}")
+        for button in self.data_buttons:
+            button["state"] = "normal"
+        try:
+            self.preprocess()
+        except Exception as err:
+            self.data = diffraction.LoadData(None)
+            showinfo("Error", f"Couldn't preprocess the example data:\n\n{err}")
+        STARTUP.mark("ready")
+        if self.startup_report == "json":
+            print(json.dumps(STARTUP.to_dict()))
+        elif self.startup_report is not None:
+            print(STARTUP.report())
+        if self.exit_when_ready:
+            self.root.after_idle(self.quit)
+
+    def quit(self):
+        self.worker.quit()
+        self.exporter.pool.shutdown(wait=True)
+        self.root.destroy()
 
     def edit_det_params(self):
         for entry in self.det_params_entries:
@@ -268,7 +385,7 @@ class App:
 
     def man_sw(self):
         self.solver.shrinkwrap(self.sw_sigma.get(), self.sw_thresh.get())
-        self.axes[0].set(data=self.solver.support.array, clim=[0, 1])
+        self.axes[0].set(data=self.solver.support_image, clim=[0, 1])
         self.image_canvas[0].draw()
 
     def man_hio(self):
@@ -296,53 +413,97 @@ class App:
     def start(self):
         self.is_running = True
         self.start_button.state(["disabled"])
-        self.run()
+        self.update_params()
+        self.worker.resume()
+        self.root.after(self.frame_ms, self.render)
 
     def stop(self):
-        self.is_running = False
+        if self.is_running:
+            self.is_running = False
+            self.worker.pause()
+            self.cache_result()
+            self.root.after_idle(self.update_images)
         self.start_button.state(["!disabled"])
 
     def stop_with_er(self):
-        self.is_running = False
-        self.start_button.state(["!disabled"])
-        self.root.after(10, self.solver.er_iteration)
-        self.root.after(15, self.update_images)
-
-    def run(self):
-        self.solver.hio_iteration(self.hio_beta.get())
-        self.solver.shrinkwrap(self.sw_sigma.get(), self.sw_thresh.get())
+        self.stop()
+        self.solver.er_iteration()
         self.update_images()
-        if self.is_running:
-            self.root.after(10, self.run)
+
+    def update_params(self):
+        self.worker.params = (self.algorithm.get(), self.hio_beta.get(), self.sw_sigma.get(), self.sw_thresh.get())
+        self.autosave.params = self.result_params()
+
+    def render(self):
+        """Draw the newest snapshot from the solver thread, then schedule the next frame."""
+        if not self.is_running:
+            return
+        if self.worker.error is not None:
+            error = self.worker.error
+            self.stop()
+            showinfo("Error", f"The reconstruction stopped:\n\n{error}")
+            return
+        self.update_params()
+        ds = self.worker.latest(shifted=False)
+        if ds is not None:
+            visible = self.visible_channels()
+            self.draw_images(*self.display.update(ds, **visible), **visible)
+        self.root.after(self.frame_ms, self.render)
 
     def update_images(self, *_):
+        if self.solver is None:
+            return
         pnl = self.control_panel.index("current")
         self.fourier = (pnl == DATA) or (pnl == MANUAL and self.fourier)
         if not pnl == AUTO:
             self.stop()
+        # Only the displayed pixels are copied while the solver is locked
+        with self.worker.lock:
+            if not self.fourier:
+                self.display.gather(self.solver._ds)
+            elif self.solver.lean:
+                # A lean solver's _fs is the scratch buffer of the next estimate, so the transform is computed afresh
+                self.display.gather(self.solver.engine.forward(self.solver._ds))
+            else:
+                self.display.gather(self.solver._fs)
+        visible = self.visible_channels()
+        amplitude, phase, vmax = self.display.convert(sqrt=self.fourier, **visible)
         if self.fourier:
-            self.images = [np.sqrt(np.abs(self.solver.fs_image)), np.angle(self.solver.fs_image)]
             for button in self.ds_buttons:
                 button.state(["disabled"])
             for button in self.fs_buttons:
                 button.state(["!disabled"])
         else:
-            self.images = [np.abs(self.solver.ds_image), np.angle(self.solver.ds_image)]
             for button in self.ds_buttons:
                 button.state(["!disabled"])
             for button in self.fs_buttons:
                 button.state(["disabled"])
-        clims = [(0, self.images[0].max()), (-np.pi, np.pi)]
         width, text = self.auto_scale_bar()
-        for img, ax, canvas, clim, bar, bar_text in zip(self.images, self.axes, self.image_canvas, clims,
-                                                        self.scale_bars, self.scale_bars_text):
+        for bar, bar_text in zip(self.scale_bars, self.scale_bars_text):
             if width == 0:
                 bar.set(visible=False)
             else:
                 bar.set(width=width, visible=True)
             bar_text.set(text=text)
+        self.draw_images(amplitude, phase, vmax, **visible)
+
+    def visible_channels(self):
+        """Which of the two images are on screen (neither, if the window is minimized), so hidden ones are skipped."""
+        return {name: bool(canvas.get_tk_widget().winfo_viewable())
+                for name, canvas in zip(["amplitude", "phase"], self.image_canvas)}
+
+    def draw_images(self, amplitude, phase, vmax, **visible):
+        for name, img, clim, ax, canvas, bar, bar_text in zip(["amplitude", "phase"], [amplitude, phase],
+                                                              [(0, vmax), (-np.pi, np.pi)], self.axes,
+                                                              self.image_canvas, self.scale_bars,
+                                                              self.scale_bars_text):
+            if not visible.get(name, True):
+                continue
             ax.set(data=img, clim=clim)
-            canvas.draw()
+            # The image fills the whole canvas, so redrawing just these artists and blitting replaces a full draw.
+            for artist in [ax, bar, bar_text]:
+                ax.axes.draw_artist(artist)
+            canvas.blit(ax.axes.bbox)
 
     def auto_scale_bar(self):
         try:
@@ -360,39 +521,103 @@ class App:
             return 0, ""
 
     def center(self):
-        self.solver.center()
+        with self.worker.lock:
+            self.solver.center()
         self.update_images()
 
     def remove_twin(self):
-        self.solver.remove_twin()
+        with self.worker.lock:
+            self.solver.remove_twin()
         self.update_images()
 
     def gaussian_blur(self):
-        self.solver.gaussian_blur()
+        with self.worker.lock:
+            self.solver.gaussian_blur()
         self.update_images()
 
     def load_data(self):
         self.data.load_data()
-        self.preprocess()
-        self.restart()
+        if not self.preprocess():
+            self.restart()
 
     def load_bkgd(self):
         self.data.load_bkgd()
-        self.preprocess()
-        self.restart()
-
-    def preprocess(self, *_):
-        self.solver = phasing.Solver(self.data.preprocess(self.pre_bkgd.get(),
-                                                          self.pre_bin_q.get(),
-                                                          self.pre_bin_factor.get(),
-                                                          self.pre_crop_q.get(),
-                                                          self.pre_crop_factor.get(),
-                                                          self.pre_gauss_q.get(),
-                                                          self.pre_gauss_sigma.get(),
-                                                          self.pre_threshold_q.get(),
-                                                          self.pre_threshold_val.get(),
-                                                          )
-                                     )
+        if not self.preprocess():
+            self.restart()
+
+    def toggle_watch(self):
+        """Start or stop streaming new files from a folder into the data while the reconstruction keeps running."""
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.watch_button["text"] = "Watch folder"
+            return
+        directory = askdirectory()
+        if not directory:
+            return
+        self.watcher = watch.WatchThread(directory)
+        self.watcher.start()
+        self.watch_first = True
+        self.watch_reported = 0  # how many of the watcher's unreadable files have been reported
+        self.watch_button["text"] = "Stop watching"
+        self.root.after(WATCH_POLL_MS, self.poll_watch)
+
+    def poll_watch(self):
+        if self.watcher is None:
+            return
+        # Unreadable files and batches that can't be added (e.g. frames of another shape) are reported and skipped,
+        # and watching carries on
+        errors = [f"{Path(filepath).name}: {err}" for filepath, err in self.watcher.failed[self.watch_reported:]]
+        self.watch_reported += len(errors)
+        batch = self.watcher.take()
+        if batch is not None:
+            try:
+                if self.watch_first:
+                    # The first files replace whatever was loaded before, so they get a reconstruction of their own.
+                    # Everything after them is added on, and swapped into the running reconstruction.
+                    self.data.use_frames(batch)
+                    self.watch_first = False
+                    if not self.preprocess():
+                        self.restart()
+                else:
+                    self.data.add_frames(batch)
+                    self.preprocess(hot_swap=True)
+            except Exception as err:
+                errors.append(f"{batch.n_frames} new frames: {err}")
+        if errors:
+            showinfo("Error", "Couldn't add to the data from the watched folder:\n\n" + "\n".join(errors))
+        self.root.after(WATCH_POLL_MS, self.poll_watch)
+
+    def schedule_preprocess(self, *_):
+        """Run preprocess once the controls have been still for a moment, rather than on every slider step."""
+        if self._preprocess_job is not None:
+            self.root.after_cancel(self._preprocess_job)
+        self._preprocess_job = self.root.after(PREPROCESS_DELAY_MS, self.preprocess)
+
+    def preprocess(self, *_, hot_swap=False):
+        """
+        Preprocess the data for a new reconstruction, or with hot_swap, update the running one's diffraction. Returns
+        True if the reconstruction carries on from an earlier one: the same data, or a cached result for them.
+        """
+        self._preprocess_job = None
+        if self.data is None or self.data.image is None:
+            return True  # no data (yet), so no reconstruction to start over either
+        diffraction = self.data.preprocess(**self.preprocess_params())
+        carried_on = True
+        # Only start a new reconstruction if the preprocessed data actually changed
+        if self.data.last_key != self.solver_key:
+            if hot_swap and self.solver is not None and diffraction.shape == self.solver.shape:
+                with self.worker.lock:
+                    self.solver.set_diffraction(diffraction)
+                self.solver_key, self.solver_data = self.data.last_key, self.data_params()
+                self.cache_solver = True
+            else:
+                with self.worker.lock:
+                    if self.worker.iterations:
+                        self.autosave.save_now(self.solver, self.worker.iterations)
+                carried_on = self.replace_solver(diffraction)
+        if self.solver is None:
+            return carried_on
         try:
             if self.pre_bin_q.get():
                 det_pitch = self.det_pitch.get() * self.pre_bin_factor.get()
@@ -402,6 +627,73 @@ class App:
         except tk.TclError:
             self.solver.pixel_size = None
         self.update_images()
+        return carried_on
+
+    def result_key(self, data_key):
+        return cache.result_key(data_key, source="live", precision=ut.PRECISION)
+
+    def replace_solver(self, diffraction):
+        """
+        Switch to the cached reconstruction of the current data if there is one, or else start a new one. The current
+        reconstruction is cached first. Returns True if a cached one was picked up.
+        """
+        self.cache_result()
+        cached = self.cache.get(self.result_key(self.data.last_key))
+        if cached is None:
+            try:
+                self.solver, params = phasing.Solver(diffraction), {}
+            except MemoryError as err:
+                # Not even the lean layout fits, so the current reconstruction (if any) carries on
+                showinfo("Error", f"Not enough memory for a reconstruction of the preprocessed data. Binning or "
+                                  f"cropping the data makes it smaller.\n\n{err}")
+                return True
+        else:
+            self.solver, params = cached
+            self.apply_params(params)
+        self.worker.set_solver(self.solver)
+        self.update_algorithms()
+        for tab in [MANUAL, AUTO]:
+            self.control_panel.tab(tab, state="normal")
+        with self.worker.lock:
+            self.worker.iterations = self.cached_iterations = params.get("iterations", 0)
+        self.solver_key, self.solver_data = self.data.last_key, self.data_params()
+        self.cache_solver = True
+        return cached is not None
+
+    def cache_result(self):
+        """Store the current reconstruction in the cache (on the exporter's threads), if it has moved on since."""
+        with self.worker.lock:
+            if not self.cache_solver or self.worker.iterations <= self.cached_iterations:
+                return
+            # By now, the controls (or the data) may already have moved on to what replaces this reconstruction
+            bundle = checkpoint.state_bundle(self.solver, {**self.result_params(), **self.solver_data})
+            self.cached_iterations = self.worker.iterations
+        self.exporter.pool.submit(self.cache.put, self.result_key(self.solver_key), bundle)
+
+    def preprocess_params(self):
+        return {"sub_bkgd": self.pre_bkgd.get(),
+                "do_binning": self.pre_bin_q.get(),
+                "binning": self.pre_bin_factor.get(),
+                "do_cropping": self.pre_crop_q.get(),
+                "cropping": self.pre_crop_factor.get(),
+                "do_gaussian": self.pre_gauss_q.get(),
+                "sigma": self.pre_gauss_sigma.get(),
+                "do_thresh": self.pre_threshold_q.get(),
+                "thresh": self.pre_threshold_val.get()}
+
+    def data_params(self):
+        return {"preprocess": self.preprocess_params(), "data_key": self.data.image_key, "n_images": self.data.n_images}
+
+    def result_params(self):
+        """Everything needed to reproduce the current result, for saving alongside it."""
+        params = {**self.data_params(), "algorithm": self.algorithm.get(), "hio_beta": self.hio_beta.get(),
+                  "sw_sigma": self.sw_sigma.get(), "sw_thresh": self.sw_thresh.get(),
+                  "iterations": self.worker.iterations}
+        try:
+            params.update(det_pitch=self.det_pitch.get(), det_dist=self.det_dist.get(), wavelength=self.wavelength.get())
+        except tk.TclError:
+            pass
+        return params
 
     def save_result(self):
         if self.save_msg:
@@ -412,17 +704,69 @@ class App:
                              "the old files WILL be overwritten!")
             self.save_msg = False
         save_dir = askdirectory()
-        np.save(f"{save_dir}/ds_raw.npy", self.solver.ds_image)
-        for img, space in zip([self.solver.ds_image, self.solver.fs_image], ["ds", "fs"]):
-            plt.imsave(f"{save_dir}/{space}_amplitude.png", np.abs(img), cmap="gray")
-            plt.imsave(f"{save_dir}/{space}_phase.png", np.angle(img), cmap="hsv")
-            plt.imsave(f"{save_dir}/{space}_combined.png", ut.complex_composite_image(img, dark_background=True))
+        if not save_dir:
+            return
+        # Only the snapshot is taken here; the bundle and the previews are written on the exporter's threads.
+        with self.worker.lock:
+            bundle = export.snapshot(self.solver, self.result_params())
+        self.check_saved(self.exporter.save(save_dir, bundle))
+
+    def restore(self):
+        """Continue from a checkpoint (by default, the automatic one) in place of the current reconstruction."""
+        filepath = askopenfilename(initialdir=AUTOSAVE.parent, initialfile=AUTOSAVE.name,
+                                   filetypes=[("Checkpoints", "*.npz *.h5"), ("All files", "*.*")])
+        if not filepath:
+            return
+        try:
+            solver, params = checkpoint.load(filepath)
+        except (OSError, ValueError, KeyError) as err:
+            showinfo("Error", f"Couldn't restore the checkpoint:\n\n{err}")
+            return
+        self.stop()
+        self.cache_result()
+        self.solver = solver
+        self.worker.set_solver(self.solver)
+        self.cached_iterations = 0
+        # The restored solver carries its own diffraction data, so only a later change to the data replaces it. Until
+        # then, it isn't cached: its data needn't be the current ones, whose key it would be stored under.
+        self.solver_key, self.solver_data = self.data.last_key, self.data_params()
+        self.cache_solver = False
+        self.apply_params(params)
+        self.update_algorithms()
+        self.update_images()
+
+    def apply_params(self, params):
+        """Set the reconstruction controls from saved result_params()."""
+        for var, name in [(self.algorithm, "algorithm"), (self.hio_beta, "hio_beta"), (self.sw_sigma, "sw_sigma"),
+                          (self.sw_thresh, "sw_thresh")]:
+            if name in params:
+                var.set(params[name])
+
+    def update_algorithms(self):
+        """Only offer the algorithms the solver can run (a lean one only runs some, see phasing.LEAN_ALGORITHMS)."""
+        available = sorted(phasing.LEAN_ALGORITHMS if self.solver.lean else phasing.ALGORITHMS)
+        self.algorithm_box["values"] = available
+        if self.algorithm.get() not in available:
+            self.algorithm.set("hio")
+
+    def check_saved(self, futures):
+        if not all(future.done() for future in futures):
+            self.root.after(200, self.check_saved, futures)
+            return
+        errors = [str(future.exception()) for future in futures if future.exception() is not None]
+        if errors:
+            showinfo("Error", "Some of the results couldn't be saved:\n\n" + "\n".join(errors))
 
     def restart(self):
+        self.cache_result()
+        self.algorithm.set("hio")
         self.hio_beta.set(0.9)
         self.sw_sigma.set(2.0)
         self.sw_thresh.set(0.2)
-        self.solver.reset()
+        with self.worker.lock:
+            self.solver.reset()
+            # A new run, which is cached (under the same key) once it has iterated at all
+            self.worker.iterations = self.cached_iterations = 0
         self.update_images()
 
 
@@ -461,4 +805,12 @@ class FormatLabel(tk.Label):
 
 
 if __name__ == "__main__":
-    App()
+    parser = argparse.ArgumentParser(description="Live phase retrieval GUI.")
+    parser.add_argument("--startup-report", nargs="?", const="text", choices=["text", "json"],
+                        default="text" if os.environ.get(STARTUP_REPORT) else None,
+                        help="print how long each step of the startup took, once the example data are in")
+    parser.add_argument("--exit-when-ready", action="store_true",
+                        help="quit as soon as the startup is done (see python -m src.benchmark --startup)")
+    args = parser.parse_args()
+    # A windowed build has no console to print to
+    App(startup_report=args.startup_report if sys.stdout is not None else None, exit_when_ready=args.exit_when_ready)
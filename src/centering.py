@@ -0,0 +1,151 @@
+"""
+Finding the center of a diffraction pattern.
+
+Methods:
+    "argmax"    the brightest point after a full-resolution gaussian blur (the original, slow method)
+    "coarse"    the same peak, found on a downsampled frame and then refined in a small full-resolution window
+    "centroid"  the intensity-weighted centroid of the bright region around the peak (sub-pixel)
+    "friedel"   the center of inversion symmetry, I(c+q) = I(c-q), from the peak of the pattern's autoconvolution
+                computed by FFT. Candidates from the downsampled frame are refined on full-resolution windows, with
+                parabolic sub-pixel interpolation, and the most symmetric one wins.
+
+Centers are cached per set of files, so reloading the same data (or loading its background) doesn't search again.
+"""
+import os
+from collections import OrderedDict
+
+import numpy as np
+import scipy.fft as sfft
+
+import src.binning as binning
+
+
+METHODS = ["argmax", "coarse", "centroid", "friedel"]
+PEAK_SIGMA = 10
+COARSE_SIZE = 256
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+
+
+def _downsample(image, max_size):
+    """Block-average the image so its largest side is at most max_size. Returns (image, factor)."""
+    factor = max(1, -(-max(image.shape) // max_size))
+    if factor == 1:
+        return image, 1
+    return binning.block_mean(image, factor), factor
+
+
+def _to_full(coords, factor):
+    """Convert coordinates on a block-averaged grid back to full-resolution pixel coordinates."""
+    return tuple(c * factor + (factor - 1) / 2 for c in coords)
+
+
+def _window(shape, ctr, half):
+    """Slices for a window of half-width `half` around ctr, clipped to the array."""
+    return tuple(slice(max(0, int(round(c)) - half), min(n, int(round(c)) + half + 1)) for c, n in zip(ctr, shape))
+
+
+def _argmax(image):
+    import scipy.ndimage as ndi  # slow to import, so only once a center is searched for
+    blurred = ndi.gaussian_filter(image, PEAK_SIGMA)
+    return np.unravel_index(np.argmax(blurred), image.shape)
+
+
+def _coarse(image):
+    import scipy.ndimage as ndi
+    small, factor = _downsample(image, COARSE_SIZE)
+    blurred = ndi.gaussian_filter(small, PEAK_SIGMA / factor)
+    coarse = _to_full(np.unravel_index(np.argmax(blurred), small.shape), factor)
+    # Refine in a window that leaves room for the filter: only the middle +/- factor pixels are searched.
+    search = factor + 1
+    window = _window(image.shape, coarse, search + 4 * PEAK_SIGMA)
+    blurred = ndi.gaussian_filter(image[window], PEAK_SIGMA)
+    inner = _window(blurred.shape, [c - w.start for c, w in zip(coarse, window)], search)
+    peak = np.unravel_index(np.argmax(blurred[inner]), blurred[inner].shape)
+    return tuple(int(p + i.start + w.start) for p, i, w in zip(peak, inner, window))
+
+
+def _centroid(image, threshold=0.5):
+    import scipy.ndimage as ndi
+    small, factor = _downsample(image, COARSE_SIZE)
+    smooth = ndi.gaussian_filter(small, 1)
+    labels, _ = ndi.label(smooth > threshold * smooth.max())
+    region = ndi.find_objects((labels == labels.flat[np.argmax(smooth)]).astype(int))[0]
+    # Centroid of the full-resolution pixels in the bright region's bounding box
+    window = tuple(slice(s.start * factor, s.stop * factor) for s in region)
+    patch = image[window]
+    weights = np.where(patch > threshold * patch.max(), patch, 0)
+    return tuple(float(c + w.start) for c, w in zip(ndi.center_of_mass(weights), window))
+
+
+def _parabolic(values, i):
+    """Sub-pixel offset of a peak at index i from the parabola through its neighbors."""
+    if i == 0 or i == len(values) - 1:
+        return 0.0
+    lo, mid, hi = values[i - 1], values[i], values[i + 1]
+    denom = lo - 2 * mid + hi
+    return 0.0 if denom == 0 else 0.5 * (lo - hi) / denom
+
+
+def _symmetry_center(image):
+    """
+    The point c about which I(c+q) = I(c-q) holds best, and how well it holds (1 for perfect symmetry).
+
+    The (zero-padded) autoconvolution of I peaks at 2c, since that's where each pixel meets its mirror image. The mean
+    is subtracted first, so the peak isn't pulled towards the middle of the array by the overlap area.
+    """
+    a = image - image.mean()
+    shape = tuple(sfft.next_fast_len(2 * n, real=True) for n in a.shape)
+    conv = sfft.irfftn(sfft.rfftn(a, shape)**2, shape)
+    peak = np.unravel_index(np.argmax(conv), conv.shape)
+    # Refined along each axis separately, through the peak
+    ctr = [(p + _parabolic(conv[peak[:axis] + (slice(None),) + peak[axis + 1:]], p)) / 2 for axis, p in enumerate(peak)]
+    return tuple(ctr), conv[peak] / max(np.vdot(a, a), np.finfo(float).tiny)
+
+
+def _friedel(image, window=128):
+    amp = np.sqrt(np.clip(image, 0, None))  # amplitudes, so the central peak doesn't drown out the rest
+    small, factor = _downsample(amp, COARSE_SIZE)
+    # Downsampling averages away fine speckle, so the intensity peak is kept as a second starting point.
+    guesses = [_to_full(_symmetry_center(small)[0], factor), _coarse(image)]
+    best, best_score = None, -np.inf
+    for guess in guesses:
+        # Refine on a full-resolution window around the guess, which is (nearly) symmetric if the guess is close
+        half = min(window, *(min(c, n - 1 - c) for c, n in zip(guess, image.shape)))
+        win = _window(image.shape, guess, max(int(half), 8))
+        local, score = _symmetry_center(amp[win])
+        if score > best_score:
+            best, best_score = tuple(float(c + w.start) for c, w in zip(local, win)), score
+    return best
+
+
+def find_center(image, method="coarse"):
+    """Find the center of a diffraction pattern (2D or 3D), as one coordinate per axis, e.g. (row, col)."""
+    funcs = {"argmax": _argmax, "coarse": _coarse, "centroid": _centroid, "friedel": _friedel}
+    if method not in funcs:
+        raise ValueError(f"Unknown centering method '{method}' (available: {METHODS})")
+    return funcs[method](np.asarray(image))
+
+
+def _file_key(filepaths, method):
+    stats = []
+    for filepath in filepaths:
+        st = os.stat(filepath)
+        stats.append((os.path.abspath(filepath), st.st_mtime_ns, st.st_size))
+    return tuple(stats), method
+
+
+def find_center_cached(filepaths, image, method="coarse"):
+    """Same as find_center, but remembered for the given files (as long as they aren't modified)."""
+    try:
+        key = _file_key(filepaths, method)
+    except OSError:
+        return find_center(image, method)
+    if key in _cache:
+        _cache.move_to_end(key)
+    else:
+        _cache[key] = find_center(image, method)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return _cache[key]
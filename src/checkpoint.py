@@ -0,0 +1,55 @@
+"""
+Saving and restoring the full state of a Solver, so that long reconstructions can be resumed after a crash (or after
+the data is changed by accident).
+
+A checkpoint is an uncompressed export bundle holding Solver.state_dict() plus a dict of parameters, such as the number
+of iterations done so far.
+"""
+import json
+
+import numpy as np
+
+import src.export as export
+from src.phasing import Solver
+
+
+DEFAULT_EVERY = 500
+
+
+def state_bundle(solver, params=None):
+    return {**solver.state_dict(), "params": np.array(json.dumps(params or {}))}
+
+
+def save(filepath, solver, params=None):
+    return export.write_bundle(filepath, state_bundle(solver, params), compress=False)
+
+
+def load(filepath):
+    """Restore a Solver from a checkpoint. Returns (solver, params)."""
+    bundle = export.read_bundle(filepath)
+    return Solver.from_state(bundle), bundle["params"]
+
+
+class AutoCheckpoint:
+    """
+    Checkpoints a solver every `every` iterations, on the exporter's background threads.
+
+    Call it as autosave(solver, n_iterations) after each iteration (it's a valid recipe callback, too). Only the copy of
+    the state happens on the calling thread, and a checkpoint is skipped if the previous one is still being written.
+    `params` is saved along with the state; it can be replaced at any time.
+    """
+    def __init__(self, filepath, every=DEFAULT_EVERY, exporter=None, params=None):
+        self.filepath = filepath
+        self.every = every
+        self.exporter = export.Exporter(max_workers=1) if exporter is None else exporter
+        self.params = params or {}
+
+    def __call__(self, solver, n_iterations):
+        if self.every and n_iterations % self.every == 0:
+            self.save_now(solver, n_iterations, force=False)
+
+    def save_now(self, solver, n_iterations=None, force=True):
+        params = dict(self.params)
+        if n_iterations is not None:
+            params["iterations"] = params.get("start_iterations", 0) + n_iterations
+        return self.exporter.checkpoint(self.filepath, state_bundle(solver, params), force=force)
@@ -1,43 +1,63 @@
 """
 Classes of simulated objects to perform phase retrieval
 """
+import hashlib
+from collections import OrderedDict
 from pathlib import Path
 from tkinter.filedialog import askopenfilenames
 
 import numpy as np
 # import skimage.draw as draw
-import scipy.ndimage as ndi
-from PIL import Image
+
+import src.utils as ut
+import src.accumulate as accumulate
+import src.readers as readers
+import src.binning as binning
+import src.centering as centering
 
 
 RNG = np.random.default_rng(1234)
 MAX_SIZE = 1024
+MAX_VOLUME_SIZE = 512  # per axis; at 512³, each complex64 buffer of a Solver is 1 GiB
+PREPROCESS_CACHE_SIZE = 16
+CENTER_METHOD = "coarse"  # see src.centering.METHODS
 INIT_DATA = f"{Path(__file__).parents[1].as_posix()}/example_data/ideal_1.tif"
+FILETYPES = [("Diffraction data", "*.tif *.tiff *.npy *.h5 *.hdf5 *.nxs *.cxi *.png"), ("All files", "*.*")]
+
 
+def grayscale(image, ndim=2, dtype=None):
+    """Sum the color channels (a last axis beyond ndim) of a frame, if it has any."""
+    image = np.asarray(image)
+    if image.ndim == ndim + 1:
+        image = np.sum(image, axis=-1, dtype=dtype)
+    return image
 
-def im_convert(image, ctr=None):
-    # Convert to grayscale if necessary
-    if image.ndim == 3:
-        image = np.sum(image, axis=-1)
+
+def im_convert(image, ctr=None, dtype=None, method=CENTER_METHOD, ndim=2, square=True):
+    """
+    Turn summed intensities into centered amplitudes: a 2D frame (with an extra last axis for color channels, if any),
+    or a 3D volume with ndim=3. With square, the data are cropped to a square (or cube) around the center, otherwise
+    each axis keeps its length and is only recentered. Returns the amplitudes and the center.
+    """
+    # Work in the requested floating-point precision from the start, so that integer frames don't end up as float64
+    if dtype is None:
+        dtype = ut.dtypes()[0]
+    image = grayscale(image, ndim, dtype).astype(dtype, copy=False)
 
     # Find the center point in the diffraction pattern
-    shape = np.array(image.shape)
-    arr_ctr = shape // 2
     if ctr is None:
-        blurred = ndi.gaussian_filter(image, 10)
-        ctr = np.unravel_index(np.argmax(blurred, axis=None), image.shape)
-    image = np.roll(image, (arr_ctr[0] - ctr[0], arr_ctr[1] - ctr[1]), axis=(0, 1))
+        ctr = centering.find_center(image, method)
 
-    # Crop to a square
-    x, y = (shape - np.min(shape)) // 2
-    if x != 0:
-        image = image[x:-x]
-    if y != 0:
-        image = image[:, y:-y]
+    # Recenter (and crop) in one step, by gathering the window around the center (wrapping around the edges, like
+    # np.roll would). Only the cropped output is copied.
+    sizes = [min(image.shape)] * image.ndim if square else image.shape
+    index = [(np.arange(n) - n // 2 + int(round(c))) % size for n, c, size in zip(sizes, ctr, image.shape)]
+    image = image[np.ix_(*index)]
 
-    if image.shape[0] > MAX_SIZE:
-        scale_coeff = MAX_SIZE / np.array(image.shape)
-        image = ndi.zoom(image, scale_coeff, order=5, prefilter=True)
+    # Bin large data down, summing counts (block binning when the size divides evenly, area binning otherwise)
+    max_size = MAX_SIZE if image.ndim == 2 else MAX_VOLUME_SIZE
+    if max(image.shape) > max_size:
+        image = binning.resize(image, tuple(min(n, max_size) for n in image.shape)).astype(dtype, copy=False)
 
     image = np.sqrt(image)
 
@@ -45,59 +65,188 @@ def im_convert(image, ctr=None):
 
 
 class LoadData:
-    def __init__(self, filepath=INIT_DATA):
-        self.image, self.ctr = im_convert(np.asarray(Image.open(filepath)))
-        self.n_images = 1
+    """
+    Diffraction data, and their preprocessing. With ndim=3, each file holds a 3D volume (e.g. a Bragg CDI rocking
+    curve, see readers.open_volume), volumes from several files are summed, and their axes aren't cropped to a cube.
+    """
+    def __init__(self, filepath=INIT_DATA, precision=None, ndim=2):
+        self.dtype = ut.dtypes(precision)[0]
+        self.ndim = ndim
+        self.reader = readers.open_frames if ndim == 2 else readers.open_volume
+        self._image = self._bkgd = None
+        self._image_key = self._bkgd_key = None
+        # Outputs of the preprocessing stages, keyed by the input data and the parameters of every stage so far
+        self._cache = OrderedDict()
+        self.last_key = None
         self.bkgd = None
         self.n_bkgds = 0
+        # Running sums (with per-pixel statistics) of the raw data and background frames
+        self.bkgd_frames = None
+        # Without a file, the data starts out empty, to be filled in by use_frames (e.g. when watching a folder).
+        self.frames = self.image = self.ctr = None
+        self.n_images = 0
+        if filepath is not None:
+            self.use_frames(accumulate.accumulate([filepath], self.reader), [filepath])
+
+    # The raw image and background are read-only, so the content keys computed from them can never go stale.
+    @property
+    def image(self):
+        return self._image
+
+    @image.setter
+    def image(self, value):
+        self._image = _read_only(value)
+        self._image_key = None
+
+    @property
+    def bkgd(self):
+        return self._bkgd
+
+    @bkgd.setter
+    def bkgd(self, value):
+        self._bkgd = _read_only(value)
+        self._bkgd_key = None
+
+    @property
+    def image_key(self):
+        """A hash of the raw image's contents"""
+        if self._image_key is None:
+            self._image_key = content_key(self._image)
+        return self._image_key
 
-    def load_data(self):
-        fs = askopenfilenames()
+    @property
+    def bkgd_key(self):
+        if self._bkgd_key is None:
+            self._bkgd_key = content_key(self._bkgd)
+        return self._bkgd_key
+
+    def load_data(self, fs=None):
+        if fs is None:
+            fs = askopenfilenames(filetypes=FILETYPES)
         if len(fs) == 0:
             return
-        self.n_images = len(fs)
-        if self.n_images == 1:
-            self.image, self.ctr = im_convert(np.asarray(Image.open(fs[0])))
+        # Frames are summed as they're read (files may hold stacks of frames), so memory use doesn't grow with the
+        # number of files or frames.
+        self.use_frames(accumulate.accumulate(fs, self.reader), fs)
+
+    def use_frames(self, frames, fs=None):
+        """Replace the data with the frames summed in an accumulator, dropping any background."""
+        self.frames = frames
+        self.n_images = frames.n_frames
+        # The center is remembered per set of files, so reloading them skips the search. The background reuses it.
+        # It's searched on the grayscale image, since the color channels aren't a spatial axis.
+        image = grayscale(frames.sum, self.ndim, self.dtype)
+        if fs is None:
+            self.ctr = centering.find_center(image, CENTER_METHOD)
         else:
-            imstack = [np.asarray(Image.open(f)) for f in fs]
-            self.image, self.ctr = im_convert(np.sum(imstack, axis=0))
+            self.ctr = centering.find_center_cached(fs, image, CENTER_METHOD)
+        self.image, _ = self._convert(image)
         self.bkgd = None
         self.n_bkgds = 0
+        self.bkgd_frames = None
+
+    def add_frames(self, frames):
+        """
+        Merge newly acquired frames (an accumulator) into the data, e.g. while watching a folder during acquisition.
+
+        The center found for the first frames is kept, so the data only grows and never jumps around. The background is
+        rescaled to match the new number of frames.
+        """
+        n_before = self.n_images
+        self.frames.merge(frames)
+        self.n_images = self.frames.n_frames
+        self.image, _ = self._convert(self.frames.sum)
+        if self.bkgd is not None:
+            self.bkgd = self.bkgd * np.sqrt(self.n_images / n_before)
 
-    def load_bkgd(self):
-        fs = askopenfilenames()
+    def load_bkgd(self, fs=None):
+        if fs is None:
+            fs = askopenfilenames(filetypes=FILETYPES)
         if len(fs) == 0:
             return
-        self.n_bkgds = len(fs)
-        if self.n_bkgds == 1:
-            self.bkgd, _ = im_convert(np.asarray(Image.open(fs[0])), self.ctr)
-        else:
-            imstack = [np.asarray(Image.open(f)) for f in fs]
-            self.bkgd, _ = im_convert(np.sum(imstack, axis=0), self.ctr)
+        self.bkgd_frames = accumulate.accumulate(fs, self.reader)
+        self.n_bkgds = self.bkgd_frames.n_frames
+        bkgd, _ = self._convert(self.bkgd_frames.sum)
         # Background subtraction only works when the scale of the background matches the scale of the data.
-        self.bkgd *= np.sqrt(self.n_images / self.n_bkgds)
+        self.bkgd = bkgd * np.sqrt(self.n_images / self.n_bkgds)
+
+    def _convert(self, image):
+        return im_convert(image, self.ctr, self.dtype, ndim=self.ndim, square=self.ndim == 2)
 
     def preprocess(self, sub_bkgd=False, do_binning=False, binning=1, do_cropping=False, cropping=1, do_gaussian=False,
-                   sigma=1, do_thresh=False, thresh=1, do_vign=False, vsigma=1):
-        image = np.copy(self.image)
-        if sub_bkgd and self.bkgd is not None:
-            image = image - self.bkgd
-            image[image < 0] = 0
-        if do_binning:
-            image = ndi.zoom(image, 1/binning, order=1)
-        if do_cropping and cropping < 1:
-            n = int(image.shape[0] * (1-cropping) / 2)
-            image = image[n:-n, n:-n]
-        if do_gaussian:
-            image = ndi.gaussian_filter(image, sigma=sigma)
-        if sub_bkgd and self.bkgd is None:
-            image = image - np.median(image)
-            image[image < 0] = 0
-        if do_thresh:
-            image[image < np.quantile(image, thresh)] = 0
-        if do_vign:
-            step = image.shape[0] * 1j
-            x, y = np.mgrid[-1:1:step, -1:1:step]
-            mask = np.exp(-(x**2+y**2)/(2*vsigma**2))
-            image = image * mask
+                   sigma=1, do_thresh=False, thresh=1, do_vign=False, vsigma=1, pad_fft=True):
+        """
+        Run the enabled preprocessing stages in order, reusing cached results wherever possible.
+
+        Each stage's output is cached under a key built from the raw data and the parameters of that stage and every
+        stage before it. Changing a late parameter (e.g. the threshold) therefore reuses the cached output of the
+        earlier stages (e.g. binning and blurring), and returning to earlier settings costs nothing. The returned
+        array is read-only; the key it was cached under is kept as `last_key`.
+
+        With pad_fft, the result is zero-padded to the next FFT-friendly size (see utils.fft_size), since binning and
+        cropping can leave sizes such as 1021 whose FFTs are several times slower.
+        """
+        stages = [
+            ("bkgd", sub_bkgd and self.bkgd is not None, self.bkgd_key if sub_bkgd else None,
+             lambda im: np.maximum(im - self.bkgd, 0)),
+            ("binning", do_binning and binning > 1, binning, lambda im: _bin(im, binning)),
+            ("cropping", do_cropping and cropping < 1, cropping, lambda im: _crop(im, cropping)),
+            ("gaussian", do_gaussian, sigma, lambda im: _gaussian(im, sigma)),
+            ("median", sub_bkgd and self.bkgd is None, None, lambda im: np.maximum(im - np.median(im), 0)),
+            ("threshold", do_thresh, thresh, lambda im: np.where(im < np.quantile(im, thresh), 0, im)),
+            ("vignette", do_vign, vsigma, lambda im: im * _vignette(im.shape, vsigma, im.dtype)),
+            ("fft_size", pad_fft, ut.FFT_FACTORS, ut.pad_to_fft_size),
+        ]
+        image = self.image
+        key = (self.image_key,)
+        for name, enabled, params, func in stages:
+            if not enabled:
+                continue
+            key = (key, name, params)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            else:
+                self._cache[key] = _read_only(func(image))
+                while len(self._cache) > PREPROCESS_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            image = self._cache[key]
+        self.last_key = key
         return image
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+def content_key(arr):
+    if arr is None:
+        return None
+    h = hashlib.blake2b(f"{arr.shape}{arr.dtype}".encode(), digest_size=16)
+    h.update(np.ascontiguousarray(arr))
+    return h.hexdigest()
+
+
+def _read_only(arr):
+    if isinstance(arr, np.ndarray):
+        arr.flags.writeable = False
+    return arr
+
+
+def _bin(image, factor):
+    # The image holds amplitudes, so it's the intensities that are averaged over each bin.
+    return np.sqrt(binning.bin_image(np.square(image), factor, mean=True)).astype(image.dtype, copy=False)
+
+
+def _gaussian(image, sigma):
+    import scipy.ndimage as ndi  # slow to import, so only once the data are actually blurred
+    return ndi.gaussian_filter(image, sigma=sigma)
+
+
+def _crop(image, cropping):
+    # The same margin along every axis, as a fraction of the first one (which keeps a square image square)
+    n = int(image.shape[0] * (1-cropping) / 2)
+    return image[tuple(slice(n, size - n) for size in image.shape)]
+
+
+def _vignette(shape, vsigma, dtype):
+    grids = np.mgrid[tuple(slice(-1, 1, size * 1j) for size in shape)]
+    return np.exp(-sum(grid**2 for grid in grids)/(2*vsigma**2)).astype(dtype)
@@ -0,0 +1,57 @@
+"""
+Display buffers for the live GUI.
+
+The canvas is only a few hundred pixels across, so there's no point in computing amplitudes and phases for every pixel
+of a 1024² (or larger) reconstruction. The display takes every `step`-th pixel, with the step matched to the canvas size,
+gathering them straight out of the solver's unshifted arrays in centered order (so no fftshift copy is made), then
+computes the amplitude and phase of just those pixels into preallocated float32 buffers.
+"""
+import numpy as np
+
+
+class DisplayBuffers:
+    def __init__(self, canvas_px):
+        self.canvas_px = canvas_px
+        self.shape = None
+        self._index = None
+        self._gathered = None
+        self.amplitude = None
+        self.phase = None
+
+    def _allocate(self, shape, dtype):
+        step = max(1, min(shape) // self.canvas_px)
+        # fftshift(x)[i] == x[(i - n//2) % n], so these indices read the centered image out of the unshifted array
+        rows, cols = ((np.arange(0, n, step) - n // 2) % n for n in shape)
+        self._index = (rows[:, None] * shape[1] + cols).ravel()
+        self.shape = (rows.size, cols.size)
+        self._gathered = np.empty(self.shape, dtype=dtype)
+        self.amplitude = np.empty(self.shape, dtype=np.float32)
+        self.phase = np.empty(self.shape, dtype=np.float32)
+        self._source = (shape, dtype)
+
+    def gather(self, unshifted):
+        """Copy the displayed pixels out of a complex array in unshifted (FFT) order. Only this step reads the array."""
+        if self._index is None or self._source != (unshifted.shape, unshifted.dtype):
+            self._allocate(unshifted.shape, unshifted.dtype)
+        np.take(unshifted, self._index, out=self._gathered.reshape(-1))
+
+    def update(self, unshifted, sqrt=False, amplitude=True, phase=True):
+        self.gather(unshifted)
+        return self.convert(sqrt, amplitude, phase)
+
+    def convert(self, sqrt=False, amplitude=True, phase=True):
+        """
+        Compute the amplitude and phase of the gathered pixels. Returns (amplitude, phase, max amplitude).
+
+        With sqrt, the square root of the amplitude is shown instead (for diffraction patterns). Either channel can be
+        skipped, e.g. when it isn't visible; its buffer then keeps its previous contents.
+        """
+        vmax = None
+        if amplitude:
+            np.abs(self._gathered, out=self.amplitude)
+            if sqrt:
+                np.sqrt(self.amplitude, out=self.amplitude)
+            vmax = float(self.amplitude.max())
+        if phase:
+            np.arctan2(self._gathered.imag, self._gathered.real, out=self.phase)
+        return self.amplitude, self.phase, vmax
@@ -0,0 +1,149 @@
+"""
+Headless ensemble reconstructions, run in parallel across processes.
+
+Every run is an independent Solver with its own seed. The diffraction pattern is put in shared memory once, and each
+worker process attaches to it when it starts instead of receiving a pickled copy with every task. The results are
+aligned to each other, averaged, and summarized by the phase retrieval transfer function (PRTF).
+
+Usage: python -m src.ensemble [data.tif] --runs 20 --output ensemble.npz
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import src.phasing as phasing
+import src.recipe as recipe
+import src.utils as ut
+
+
+DEFAULT_RECIPE = "HIO:200, SW every 1, ER:20"
+
+
+# Set in each worker process by _attach()
+_shm = None
+_diffraction = None
+
+
+def _attach(name, shape, dtype, fft_backend, fft_workers):
+    global _shm, _diffraction
+    # The processes already keep every core busy, so each one's FFTs only get its share of the threads
+    ut.set_fft_backend(fft_backend, workers=fft_workers)
+    _shm = shared_memory.SharedMemory(name=name)
+    _diffraction = np.ndarray(shape, dtype=dtype, buffer=_shm.buf)
+
+
+def _reconstruct(seed, recipe_text, beta, sigma, threshold, precision):
+    solver = phasing.Solver(_diffraction, seed=seed, precision=precision)
+    solver.run_recipe(recipe_text, beta, sigma, threshold)
+    ds_image = solver.ds_image
+    return ds_image, fourier_error(ds_image, _diffraction)
+
+
+def fourier_error(ds_image, diffraction):
+    """Squared difference between the modeled and measured amplitudes, relative to the measured intensity."""
+    return np.sum((np.abs(ut.fft(ds_image)) - diffraction)**2) / np.sum(diffraction**2)
+
+
+def twin(image):
+    """The twin image, which has exactly the same diffraction amplitude."""
+    return np.conj(image[::-1, ::-1])
+
+
+def align(image, reference):
+    """Match the twin orientation, translation and global phase offset of an image to a reference."""
+    ref_spectrum = np.conj(ut.fft(np.abs(reference)))
+    best = None
+    for candidate in [image, twin(image)]:
+        # The peak of the amplitude cross-correlation gives both the translation and how good the match is.
+        xcorr = np.abs(ut.ifft(ut.fft(np.abs(candidate)) * ref_spectrum))
+        peak = np.unravel_index(np.argmax(xcorr), xcorr.shape)
+        if best is None or xcorr[peak] > best[0]:
+            best = xcorr[peak], candidate, peak
+    _, candidate, peak = best
+    shift = [(c - p) for p, c in zip(peak, np.array(image.shape) // 2)]
+    candidate = np.roll(candidate, shift, axis=(0, 1))
+    phase = np.angle(np.vdot(candidate, reference))
+    return candidate * np.exp(1j * phase)
+
+
+def radial_average(arr, mask=None):
+    """Average an array over rings of constant distance from the center pixel. Returns (radius, average)."""
+    ctr = np.array(arr.shape) // 2
+    rr, cc = np.indices(arr.shape)
+    radius = np.round(np.hypot(rr - ctr[0], cc - ctr[1])).astype(int)
+    if mask is not None:
+        radius, arr = radius[mask], arr[mask]
+    counts = np.bincount(radius.ravel())
+    sums = np.bincount(radius.ravel(), weights=arr.ravel())
+    valid = counts > 0
+    return np.arange(counts.size)[valid], sums[valid] / counts[valid]
+
+
+def prtf(images, diffraction):
+    """
+    Phase retrieval transfer function of a set of aligned reconstructions: |<F_k>| / D, averaged over rings of q.
+
+    The Fourier transform is linear, so the average of the transforms is just the transform of the average image.
+    Returns (q, prtf), where q is in pixels from the center of the diffraction pattern.
+    """
+    measured = diffraction > 0
+    ratio = np.zeros(diffraction.shape)
+    ratio[measured] = np.abs(ut.fft(np.mean(images, axis=0)))[measured] / diffraction[measured]
+    return radial_average(ratio, measured)
+
+
+def run_ensemble(diffraction, n_runs=20, n_workers=None, seed=None, recipe_text=DEFAULT_RECIPE, beta=0.9,
+                 sigma=2.0, threshold=0.2, precision=None):
+    """
+    Run n_runs independent reconstructions of the same recipe in a process pool, then align and average them.
+
+    Returns a dict with the averaged "image", the aligned "images", the per-run "errors", and the "q"/"prtf" curve.
+    """
+    recipe.compile_recipe(recipe_text)  # fail here rather than in every worker
+    # Worker processes don't necessarily share this process's defaults, so resolve the precision here
+    precision = ut.PRECISION if precision is None else precision
+    n_workers = min(n_workers or os.cpu_count() or 1, n_runs)
+    fft_workers = max(1, (os.cpu_count() or 1) // n_workers)
+    diffraction = np.ascontiguousarray(diffraction, dtype=float)
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+    shm = shared_memory.SharedMemory(create=True, size=diffraction.nbytes)
+    try:
+        shared = np.ndarray(diffraction.shape, dtype=diffraction.dtype, buffer=shm.buf)
+        shared[:] = diffraction
+        del shared  # the buffer can't be released while a view of it exists
+        with ProcessPoolExecutor(n_workers, initializer=_attach,
+                                 initargs=(shm.name, diffraction.shape, diffraction.dtype.str, ut.FFT_BACKEND,
+                                           fft_workers)) as pool:
+            futures = [pool.submit(_reconstruct, s, recipe_text, beta, sigma, threshold, precision) for s in seeds]
+            results = [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    errors = np.array([err for _, err in results])
+    reference = results[int(np.argmin(errors))][0]
+    images = np.array([align(img, reference) for img, _ in results])
+    q, curve = prtf(images, diffraction)
+    return {"image": np.mean(images, axis=0), "images": images, "errors": errors, "q": q, "prtf": curve}
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.diffraction import LoadData, INIT_DATA
+
+    parser = argparse.ArgumentParser(description="Run an ensemble of independent reconstructions in parallel.")
+    parser.add_argument("data", nargs="?", default=INIT_DATA, help="diffraction image file")
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("-r", "--recipe", default=DEFAULT_RECIPE)
+    parser.add_argument("-p", "--precision", choices=list(ut.PRECISIONS), default=ut.PRECISION)
+    parser.add_argument("-o", "--output", default="ensemble.npz")
+    args = parser.parse_args()
+
+    data = LoadData(args.data, args.precision).preprocess()
+    result = run_ensemble(data, args.runs, args.workers, args.seed, args.recipe, precision=args.precision)
+    np.savez(args.output, **result)
+    print(f"Saved {args.runs} aligned reconstructions to {args.output} (best error: {result['errors'].min():.4g})")
@@ -0,0 +1,126 @@
+"""
+Saving results in the background.
+
+A result is written as one bundle holding the object, its Fourier transform, the support, the diffraction data, the
+parameters and the metrics history: a compressed .npz, or a chunked, gzip-compressed HDF5 file if h5py is installed
+and the name ends in .h5. The PNG previews are rendered in parallel by a thread pool, so nothing blocks the GUI beyond
+copying the arrays out of the solver.
+"""
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import src.readers as readers
+import src.utils as ut
+
+
+BUNDLE_VERSION = 1
+BUNDLE_NAME = "result.npz"
+HDF5_COMPRESSION = {"compression": "gzip", "compression_opts": 4, "shuffle": True}
+
+
+def snapshot(solver, params=None):
+    """Copy everything worth saving out of a solver. Call this while holding the solver's lock, if it has one."""
+    bundle = {
+        "version": np.array(BUNDLE_VERSION),
+        "object": solver.ds_image,
+        "fourier": solver.fs_image,
+        "support": solver.support_image.copy(),
+        "diffraction": solver.diffraction,
+        "pixel_size": np.array(np.nan if solver.pixel_size is None else solver.pixel_size),
+        "fourier_error": np.array(solver.fourier_error),
+        "params": np.array(json.dumps(params or {})),
+    }
+    if solver.recorder is not None:
+        bundle["metrics"] = solver.recorder.to_array()
+    return bundle
+
+
+def write_bundle(filepath, bundle, compress=True):
+    """Write a bundle to .npz, or to HDF5 if the file name ends in .h5/.hdf5. Returns the path it was written to."""
+    filepath = Path(filepath)
+    # Write to a temporary file first, so a crash mid-write never leaves a truncated bundle behind
+    tmp = filepath.with_name(f".{filepath.name}.{uuid.uuid4().hex[:8]}.tmp")
+    if filepath.suffix.lower() in (".h5", ".hdf5"):
+        h5py = readers.load_h5py()
+        if h5py is None:
+            raise ImportError("Saving to HDF5 requires h5py, which is not installed (pip install h5py)")
+        with h5py.File(tmp, "w") as f:
+            for name, arr in bundle.items():
+                if arr.ndim == 0:
+                    f.attrs[name] = arr.item()
+                else:
+                    f.create_dataset(name, data=arr, chunks=True, **(HDF5_COMPRESSION if compress else {}))
+    else:
+        with open(tmp, "wb") as f:
+            (np.savez_compressed if compress else np.savez)(f, **bundle)
+    os.replace(tmp, filepath)
+    return filepath
+
+
+def read_bundle(filepath):
+    """Read a bundle back into a dict of arrays, with the parameters decoded into a dict."""
+    filepath = Path(filepath)
+    if filepath.suffix.lower() in (".h5", ".hdf5"):
+        h5py = readers.load_h5py()
+        if h5py is None:
+            raise ImportError("Reading HDF5 requires h5py, which is not installed (pip install h5py)")
+        with h5py.File(filepath, "r") as f:
+            bundle = {name: f[name][()] for name in f}
+            bundle.update({name: np.array(value) for name, value in f.attrs.items()})
+    else:
+        with np.load(filepath) as f:
+            bundle = dict(f)
+    bundle["params"] = json.loads(str(bundle["params"]))
+    return bundle
+
+
+def _save_png(filepath, image, kind):
+    # What pyplot.imsave calls, without importing pyplot (and a GUI backend) along with it
+    from matplotlib.image import imsave
+    if kind == "amplitude":
+        imsave(filepath, np.abs(image), cmap="gray")
+    elif kind == "phase":
+        imsave(filepath, np.angle(image), cmap="hsv")
+    else:
+        imsave(filepath, ut.complex_composite_image(image, dark_background=True))
+
+
+def png_jobs(directory, bundle):
+    """The (filepath, image, kind) of every preview image for a bundle."""
+    return [(Path(directory) / f"{space}_{kind}.png", bundle[name], kind)
+            for name, space in [("object", "ds"), ("fourier", "fs")]
+            for kind in ["amplitude", "phase", "combined"]]
+
+
+class Exporter:
+    """Writes bundles and previews on a pool of background threads."""
+    def __init__(self, max_workers=4):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._checkpoint = None
+
+    def save(self, directory, bundle, pngs=True, name=BUNDLE_NAME):
+        """Write the bundle (and its previews) into a directory. Returns a future for each file."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        futures = [self.pool.submit(write_bundle, directory / name, bundle)]
+        if pngs:
+            futures += [self.pool.submit(_save_png, *job) for job in png_jobs(directory, bundle)]
+        return futures
+
+    def checkpoint(self, filepath, bundle, force=False):
+        """
+        Write an uncompressed bundle, unless the previous checkpoint is still being written (then it's skipped, unless
+        force is set). Returns the future, or None if it was skipped.
+        """
+        if not force and self._checkpoint is not None and not self._checkpoint.done():
+            return None
+        self._checkpoint = self.pool.submit(write_bundle, filepath, bundle, False)
+        return self._checkpoint
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,138 @@
+"""
+Planning the memory a reconstruction needs, before allocating any of it.
+
+A 512³ volume is 1 GiB per complex64 buffer, so what matters is how many full-size buffers are alive at once. A plan
+counts the buffers a Solver keeps for its whole life, plus the largest temporary arrays allocated on top of them (by a
+shrinkwrap, or by copying out a centered image), and checks the peak against a limit.
+
+The full layout keeps four complex buffers, which every algorithm can use. The lean layout keeps two, and the Fourier
+transform and the previous estimate share the memory of the next estimate: that's all ER and HIO need, since both
+transform in place and HIO only looks back at the current estimate. (See phasing.Solver.)
+
+Not counted, since they're outside the solver or small next to a buffer, which MEMORY_FRACTION leaves room for:
+    * the live GUI's three snapshots of the object (see worker.SolverThread), each the size of a complex buffer of a
+      2D reconstruction,
+    * the shrinkwrap's blur transfer functions for other sigmas, kept in utils.gaussian_transfer's cache (up to 32,
+      each half the size of a real buffer),
+    * the support arrays built by a reset.
+"""
+import os
+
+import numpy as np
+
+import src.utils as ut
+
+
+# Share of the available physical memory that a reconstruction may plan for, unless it's given a limit of its own
+MEMORY_FRACTION = 0.8
+GIB = 2**30
+
+
+def available_memory():
+    """
+    The physical memory available right now, in bytes, or None if the system won't tell.
+
+    On Linux, that's MemAvailable, which counts the page cache (reclaimable on demand) as available. Elsewhere, the
+    free pages are all there is to go by.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_limit():
+    available = available_memory()
+    return None if available is None else int(available * MEMORY_FRACTION)
+
+
+class MemoryPlan:
+    """
+    The bytes held by each buffer of a reconstruction (`buffers`), and by each temporary allocation (`transients`). Only
+    one transient is alive at a time, so the peak is the resident total plus the largest of them.
+    """
+    def __init__(self, shape, precision, lean, buffers, transients, limit):
+        self.shape = tuple(shape)
+        self.precision = precision
+        self.lean = lean
+        self.buffers = buffers
+        self.transients = transients
+        self.limit = limit
+
+    @property
+    def resident(self):
+        return sum(self.buffers.values())
+
+    @property
+    def peak(self):
+        return self.resident + max(self.transients.values(), default=0)
+
+    @property
+    def fits(self):
+        return self.limit is None or self.peak <= self.limit
+
+    def report(self):
+        """A table of every buffer and transient, in MiB, with the totals and the limit."""
+        layout = "lean" if self.lean else "full"
+        lines = [f"Memory plan for {'x'.join(map(str, self.shape))} ({self.precision} precision, {layout} layout):"]
+        lines += [f"  {name:<24}{size / 2**20:>10.1f} MiB" for name, size in self.buffers.items()]
+        lines.append(f"  {'resident':<24}{self.resident / 2**20:>10.1f} MiB")
+        lines += [f"  + {name:<22}{size / 2**20:>10.1f} MiB" for name, size in self.transients.items()]
+        limit = "no limit" if self.limit is None else f"limit {self.limit / GIB:.2f} GiB"
+        lines.append(f"  {'peak':<24}{self.peak / 2**20:>10.1f} MiB ({limit})")
+        return "\n".join(lines)
+
+
+def _layout(shape, precision, lean, n_starts, limit):
+    real_dtype, complex_dtype = ut.dtypes(precision)
+    size = int(np.prod(shape))
+    stack = size * (n_starts or 1)
+    real, complex_ = real_dtype.itemsize, complex_dtype.itemsize
+    buffers = {"diffraction": size * real, "ds": stack * complex_, "ds_next": stack * complex_}
+    if not lean:
+        buffers.update({"fs": stack * complex_, "ds_prev": stack * complex_})
+    buffers["amp"] = stack * real
+    if n_starts is not None:
+        buffers.update({"resid": stack * real, "outside": stack})
+    # The support, and the complements of its masks over the bands through its window (at most the whole array again)
+    buffers.update({"support": stack, "support window": stack})
+    if ut.FFT_BACKEND == "pyfftw":
+        buffers["fftw buffers"] = 2 * stack * complex_
+    # A Gaussian blur goes through the half spectrum of the (real) amplitude, and returns a new real array. The
+    # amplitude itself goes into the amp buffer, except in a BatchSolver. Its transfer function stays cached, and is
+    # computed in float64 the first time.
+    half = size // shape[-1] * (shape[-1] // 2 + 1)
+    buffers["blur transfer"] = half * real
+    transients = {"shrinkwrap": (n_starts or 1) * half * complex_ + stack * real * (1 if n_starts is None else 2)
+                  + half * 8}
+    transients["centered copy"] = stack * complex_
+    if not lean:
+        # OSS keeps its current full-grid filter on the solver, and computes each new one in float64
+        buffers["oss filter"] = size * real
+        transients["oss filter"] = size * 8
+    return MemoryPlan(shape, precision, lean, buffers, transients, limit)
+
+
+def plan(shape, precision=None, n_starts=None, lean=None, limit=None):
+    """
+    Plan the memory for reconstructing an array of the given shape (n_starts at once, for a BatchSolver).
+
+    The limit defaults to MEMORY_FRACTION of the physical memory available. Unless lean is given, the full layout is
+    chosen if its peak fits, and the lean one otherwise. Raises MemoryError if the chosen layout doesn't fit.
+    """
+    precision = ut.PRECISION if precision is None else precision
+    limit = default_limit() if limit is None else limit
+    if lean is None:
+        lean = n_starts is None and not _layout(shape, precision, False, n_starts, limit).fits
+    result = _layout(shape, precision, lean, n_starts, limit)
+    if not result.fits:
+        raise MemoryError(f"A reconstruction of {'x'.join(map(str, shape))} needs {result.peak / GIB:.2f} GiB at its "
+                          f"peak, over the limit of {result.limit / GIB:.2f} GiB\n{result.report()}")
+    return result
@@ -0,0 +1,64 @@
+"""
+Per-iteration convergence metrics and stage timings, recorded by an instrumented Solver.
+"""
+import numpy as np
+
+
+FIELDS = [
+    ("iteration", "i8"),
+    ("fourier_error", "f8"),   # sum((|F| - D)^2) / sum(D^2), from the modulus projection
+    ("support_error", "f8"),   # fraction of the real-space energy outside the support, before the constraint
+    ("support_size", "i8"),
+    ("t_fft", "f8"),
+    ("t_modulus", "f8"),
+    ("t_ifft", "f8"),
+    ("t_constraint", "f8"),
+    ("t_shrinkwrap", "f8"),
+]
+STAGES = [name for name, _ in FIELDS if name.startswith("t_")]
+
+
+class Recorder:
+    """A preallocated ring buffer of per-iteration records. Once it's full, the oldest records are overwritten."""
+    def __init__(self, capacity=10000):
+        self.data = np.zeros(capacity, dtype=FIELDS)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.data.size)
+
+    def new_record(self):
+        """Return the next record, as a view into the buffer that can be filled in field by field."""
+        record = self.data[self.count % self.data.size]
+        record.fill(0)
+        self.count += 1
+        record["iteration"] = self.count
+        return record
+
+    def latest(self):
+        return None if self.count == 0 else self.data[(self.count - 1) % self.data.size]
+
+    def to_array(self):
+        """All of the records currently held, oldest first."""
+        if self.count <= self.data.size:
+            return self.data[:self.count].copy()
+        start = self.count % self.data.size
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+    def to_csv(self, filepath):
+        records = self.to_array()
+        fmt = ["%d" if records.dtype[name].kind == "i" else "%.6g" for name in records.dtype.names]
+        np.savetxt(filepath, records, fmt=fmt, delimiter=",", header=",".join(records.dtype.names), comments="")
+
+    def summary(self):
+        """Mean time per iteration spent in each stage, plus the latest errors."""
+        records = self.to_array()
+        if records.size == 0:
+            return {}
+        summary = {stage: float(np.mean(records[stage])) for stage in STAGES}
+        for name in ["fourier_error", "support_error", "support_size"]:
+            summary[name] = records[name][-1].item()
+        return summary
+
+    def clear(self):
+        self.count = 0
@@ -3,24 +3,365 @@ The main phase retrieval solver class
 
 Nick Porter
 """
+import json
+import time
+import tracemalloc
+
 import numpy as np
-from scipy import ndimage as ndi
 
 import src.utils as ut
 import src.support as support
+import src.recipe as recipe
+import src.metrics as metrics
+import src.memory as memory
+
+
+# Guards the modulus projection against division by zero where the current estimate has no amplitude.
+EPSILON = 1e-12
+# Version of the layout of Solver.state_dict(). Bump it when the layout changes, and add an upgrade from the old one.
+STATE_VERSION = 1
+_STATE_UPGRADES = {}  # version -> function that turns a state of that version into one of the next version
+
+
+def upgrade_state(state):
+    """Bring a saved solver state up to the current STATE_VERSION."""
+    version = int(state.get("state_version", 0))
+    if version < 1:
+        raise ValueError("Not a saved solver state")
+    if version > STATE_VERSION:
+        raise ValueError(f"Solver state version {version} is newer than this version of the code ({STATE_VERSION})")
+    while version < STATE_VERSION:
+        state = _STATE_UPGRADES[version](state)
+        version += 1
+    return state
+
+
+def random_phase(rng, shape, dtype=np.complex128, out=None, scratch=None):
+    """
+    Unit-amplitude random phases, drawn and computed directly in the working precision. With out (complex) and scratch
+    (real) arrays of the right shape, they're computed in place, to the same values.
+    """
+    real = np.finfo(dtype).dtype
+    if out is None:
+        return np.exp((2j * np.pi) * rng.random(shape, dtype=real)).astype(dtype, copy=False)
+    rng.random(dtype=real, out=scratch)
+    np.multiply(2j * np.pi, scratch, out=out)
+    return np.exp(out, out=out)
+
+
+class Projectors:
+    """
+    In-place projector primitives shared by Solver and BatchSolver. The algorithms in ALGORITHMS only use these, plus
+    the work buffers _ds (current estimate), _ds_next (next estimate) and _ds_prev (free to use as scratch).
+
+    Real-space constraints work band by band through the support's bounding window (see support.Window): only the rows
+    through it need masked operations, and everything beyond them is known to be outside the support.
+    """
+    _record = None  # the metrics record being filled in, while an instrumented iteration runs
+    _pieces_window = None
+
+    def pieces(self):
+        """
+        (index, inside, outside) for each band of rows through the support's bounding window, where inside and outside
+        are masks of the band, then for each band beyond it, where inside is False and outside is True (so masked ufuncs
+        over those run unmasked). Rebuilt only when the support changes.
+        """
+        window = self._support_window
+        if self._pieces_window is not window:
+            mask = self._support_mask
+            self._pieces = [(index, mask[index], ~mask[index]) for index in window.bands]
+            self._pieces += [(index, False, True) for index in window.outside_bands]
+            self._pieces_window = window
+        return self._pieces
+
+    def project_modulus(self, src, out, error=False):
+        """out = P_M(src): keep the phase of src's Fourier transform, but replace its modulus with the measured one."""
+        if self._record is not None:
+            return self._project_modulus_instrumented(src, out, error)
+        self.engine.forward(src, out=self._fs)
+        self.modulus_constraint(error)
+        self.engine.inverse(self._fs, out=out)
+
+    def project_support(self, arr):
+        """arr = P_S(arr): zero everything outside the support."""
+        for index, _, outside in self.pieces():
+            np.copyto(arr[index], 0, where=outside)
+
+    def reflect_support(self, arr):
+        """arr = R_S(arr) = 2 P_S(arr) - arr: negate everything outside the support."""
+        for index, _, outside in self.pieces():
+            piece = arr[index]
+            np.negative(piece, out=piece, where=outside)
+
+    def apply_hio(self, ds, ds_prev, beta):
+        # Outside the support: ds_prev - beta*ds, computed in place
+        for index, _, outside in self.pieces():
+            piece = ds[index]
+            np.multiply(piece, -beta, out=piece, where=outside)
+            np.add(piece, ds_prev[index], out=piece, where=outside)
+
+    def _project_modulus_instrumented(self, src, out, error):
+        record = self._record
+        t0 = time.perf_counter()
+        self.engine.forward(src, out=self._fs)
+        t1 = time.perf_counter()
+        self.modulus_constraint(error)
+        t2 = time.perf_counter()
+        self.engine.inverse(self._fs, out=out)
+        t3 = time.perf_counter()
+        # Measure how much of the new estimate violates the support before a constraint removes it
+        np.abs(out, out=self._amp)
+        np.square(self._amp, out=self._amp)
+        total = self._amp.sum()
+        inside = sum(self._amp[index].sum(where=inside) for index, inside, _ in self.pieces() if inside is not False)
+        record["support_error"] = (total - inside) / total
+        record["t_fft"] += t1 - t0
+        record["t_modulus"] += t2 - t1
+        record["t_ifft"] += t3 - t2
+        self._untimed += time.perf_counter() - t3
+
+
+# Iterative algorithms, by name. Each is called as func(solver, beta, error, **params) and writes the next estimate into
+# solver._ds_next, given the current one in solver._ds. The solver rotates the buffers afterwards.
+ALGORITHMS = {}
+DEFAULT_BETAS = {"hio": 0.9, "raar": 0.87, "dm": 0.9, "oss": 0.9}
+# The algorithms that can run on a lean Solver, i.e. without separate _fs and _ds_prev buffers (see Solver)
+LEAN_ALGORITHMS = set()
+
+
+def register(name, lean=False):
+    def wrap(func):
+        ALGORITHMS[name] = func
+        if lean:
+            LEAN_ALGORITHMS.add(name)
+        return func
+    return wrap
 
 
-class Solver:
-    def __init__(self, diffraction):
-        self.diffraction = np.array(diffraction)
-        self.imsize = self.diffraction.shape[0]
-        self.ctr = self.imsize // 2
-        self.support = support.Support2D(self.imsize)
+def get_algorithm(algorithm, beta):
+    """Look up an algorithm (ER if beta is None and no name is given, HIO otherwise) and its beta."""
+    name = ("er" if beta is None else "hio") if algorithm is None else algorithm.lower()
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm '{algorithm}' (available: {sorted(ALGORITHMS)})")
+    return ALGORITHMS[name], DEFAULT_BETAS.get(name) if beta is None else beta
+
+
+@register("er", lean=True)
+def error_reduction(solver, beta, error):
+    """x' = P_S P_M x"""
+    solver.project_modulus(solver._ds, solver._ds_next, error)
+    solver.project_support(solver._ds_next)
+
+
+@register("hio", lean=True)
+def hybrid_input_output(solver, beta, error):
+    """x' = P_M x inside the support, x - beta P_M x outside"""
+    solver.project_modulus(solver._ds, solver._ds_next, error)
+    solver.apply_hio(solver._ds_next, solver._ds, beta)
+
+
+@register("raar")
+def relaxed_averaged_alternating_reflections(solver, beta, error):
+    """
+    x' = beta/2 (R_S R_M + I) x + (1 - beta) P_M x, which works out to P_M x inside the support and
+    beta x + (1 - 2 beta) P_M x outside (Luke, 2005).
+    """
+    solver.project_modulus(solver._ds, solver._ds_next, error)
+    for index, _, outside in solver.pieces():
+        x, y, scratch = solver._ds[index], solver._ds_next[index], solver._ds_prev[index]
+        np.multiply(y, 1 - 2 * beta, out=y, where=outside)
+        np.multiply(x, beta, out=scratch, where=outside)
+        np.add(y, scratch, out=y, where=outside)
+
+
+@register("dm")
+def difference_map(solver, beta, error):
+    """
+    x' = x + beta (P_S f_M(x) - P_M f_S(x)), with f_A(x) = (1 + g_A) P_A x - g_A x, g_S = -1/beta and g_M = 1/beta
+    (Elser, 2003). This costs two modulus projections per iteration. Note that the solution is P_S f_M(x) rather than
+    the iterate x itself, though the two agree once it has converged.
+    """
+    x, out, scratch = solver._ds, solver._ds_next, solver._ds_prev
+    # f_S(x) is x inside the support and x/beta outside it
+    np.copyto(scratch, x)
+    for index, _, outside in solver.pieces():
+        piece = scratch[index]
+        np.multiply(piece, 1 / beta, out=piece, where=outside)
+    solver.project_modulus(scratch, out)
+    # P_M x, last, so that the error (if requested) is the error of x
+    solver.project_modulus(x, scratch, error)
+    # Expanding the terms, x' = (beta + 1) P_M x - beta P_M f_S(x) inside the support and x - beta P_M f_S(x) outside.
+    np.multiply(out, -beta, out=out)
+    for index, inside, outside in solver.pieces():
+        piece = out[index]
+        if inside is not False:
+            np.multiply(scratch[index], beta + 1, out=scratch[index])
+            np.add(piece, scratch[index], out=piece, where=inside)
+        np.add(piece, x[index], out=piece, where=outside)
+
+
+@register("oss")
+def oversampling_smoothness(solver, beta, error, alpha=None, progress=0.0):
+    """
+    HIO, followed by smoothing the region outside the support with a Gaussian filter exp(-k^2 / 2 alpha^2) in Fourier
+    space (Rodriguez et al., 2013). The filter width alpha (in Fourier pixels) is normally lowered from N to 1/N over
+    the course of a run: if alpha isn't given, it's set by progress, which goes from 0 (start) to 1 (end).
+    """
+    hybrid_input_output(solver, beta, error)
+    n = solver.imsize
+    if alpha is None:
+        alpha = n + (1 / n - n) * progress
+    # A filter of width alpha in Fourier pixels is a real-space blur of N / (2 pi alpha) pixels
+    sigma = n / (2 * np.pi * alpha)
+    # The full-grid filter is kept on the solver, one at a time, rather than in gaussian_transfer's cache, which would
+    # keep up to 32 of them (see memory.plan)
+    if solver._oss_filter is None or solver._oss_filter[0] != sigma:
+        solver._oss_filter = None
+        solver._oss_filter = sigma, ut.make_gaussian_transfer(solver.shape, sigma, solver.real_dtype, rfft=False)
+    transfer = solver._oss_filter[1]
+    solver.engine.forward(solver._ds_next, out=solver._fs)
+    np.multiply(solver._fs, transfer, out=solver._fs)
+    solver.engine.inverse(solver._fs, out=solver._ds_prev)
+    for index, _, outside in solver.pieces():
+        np.copyto(solver._ds_next[index], solver._ds_prev[index], where=outside)
+
+
+class Solver(Projectors):
+    """
+    Phase retrieval of a 2D image or a 3D volume, of any shape.
+
+    The buffers are laid out according to a memory.MemoryPlan (kept as `memory`), which is checked against max_memory
+    bytes (by default, a share of the available memory). In the lean layout, used when the full one doesn't fit or when
+    lean=True, the Fourier transform and the previous estimate share the next estimate's buffer: that halves the number
+    of complex buffers, but only the algorithms in LEAN_ALGORITHMS can run, and fs_image is computed on request.
+    """
+    def __init__(self, diffraction, seed=None, precision=None, lean=None, max_memory=None):
+        self.precision = ut.PRECISION if precision is None else precision
+        self.real_dtype, self.complex_dtype = ut.dtypes(self.precision)
+        diffraction = np.array(diffraction, dtype=self.real_dtype)
+        self.memory = memory.plan(diffraction.shape, self.precision, lean=lean, limit=max_memory)
+        self.lean = self.memory.lean
+        self.rng = np.random.default_rng(seed)
+        self.shape = diffraction.shape
+        self.ndim = diffraction.ndim
+        # The width, which sets the pixel size (and the scale bar in the GUI)
+        self.imsize = self.shape[-1]
         self.pixel_size = None
+        self.engine = ut.get_engine(diffraction.shape, self.complex_dtype)
+
+        # Internally, every array is kept in unshifted (FFT) order so that each projection is a bare FFT. The shifts
+        # only happen when the centered images are requested, e.g. for display.
+        self._diffraction = np.fft.ifftshift(diffraction)
+        self._ds = self.engine.empty()
+        # Work buffers for the fused iteration kernel, which never allocates in steady state.
+        self._ds_next = self.engine.empty()
+        if self.lean:
+            self._fs = self._ds_prev = self._ds_next
+        else:
+            self._fs = self.engine.empty()
+            self._ds_prev = self.engine.empty()
+        self._amp = np.empty(diffraction.shape, dtype=self._diffraction.real.dtype)
+        self._diffraction_norm = np.vdot(self._diffraction, self._diffraction).real
+        self.fourier_error = np.nan
+        self.recorder = None
+        self._oss_filter = None  # (sigma, transfer function) of the latest OSS iteration
+        self.reset()
+
+    @property
+    def diffraction(self):
+        return np.fft.fftshift(self._diffraction)
+
+    @property
+    def fs_image(self):
+        if self.lean:
+            return np.fft.fftshift(self.engine.forward(self._ds))
+        return np.fft.fftshift(self._fs)
+
+    @fs_image.setter
+    def fs_image(self, value):
+        np.copyto(self._fs, np.fft.ifftshift(value))
+
+    @property
+    def ds_image(self):
+        return np.fft.fftshift(self._ds)
+
+    @ds_image.setter
+    def ds_image(self, value):
+        np.copyto(self._ds, np.fft.ifftshift(value))
+
+    @property
+    def ds_prev(self):
+        return np.fft.fftshift(self._ds_prev)
 
-        self.fs_image = self.diffraction * np.exp(2j * np.pi * np.random.random((self.imsize, self.imsize))) + 0.0
-        self.ds_image = ut.ifft(self.fs_image)
-        self.ds_prev = np.copy(self.ds_image)
+    @property
+    def support_image(self):
+        return np.fft.fftshift(self.support.array)
+
+    @property
+    def _support_mask(self):
+        return self.support.array
+
+    @property
+    def _support_window(self):
+        return self.support.window
+
+    def state_dict(self):
+        """
+        A copy of everything needed to continue this reconstruction exactly where it left off, as a dict of arrays.
+
+        That includes the random generator's state, so a restored solver draws the same numbers the original would
+        have. Arrays are kept in their internal (unshifted) order.
+        """
+        state = {
+            "state_version": np.array(STATE_VERSION),
+            "precision": np.array(self.precision),
+            "diffraction": self._diffraction.copy(),
+            "fs": self.engine.forward(self._ds) if self.lean else self._fs.copy(),
+            "ds": self._ds.copy(),
+            "ds_prev": self._ds_prev.copy(),
+            "support": self.support.array.copy(),
+            "pixel_size": np.array(np.nan if self.pixel_size is None else self.pixel_size),
+            "fourier_error": np.array(self.fourier_error),
+            "rng_state": np.array(json.dumps(self.rng.bit_generator.state)),
+        }
+        if self.recorder is not None:
+            state["metrics"] = self.recorder.data.copy()
+            state["metrics_count"] = np.array(self.recorder.count)
+        return state
+
+    @classmethod
+    def from_state(cls, state, lean=None, max_memory=None):
+        """Rebuild a Solver from state_dict() output (possibly of an older version)."""
+        state = upgrade_state(state)
+        solver = cls(np.fft.fftshift(state["diffraction"]), precision=str(state["precision"]), lean=lean,
+                     max_memory=max_memory)
+        for name, key in [("_fs", "fs"), ("_ds", "ds"), ("_ds_prev", "ds_prev")]:
+            np.copyto(getattr(solver, name), state[key])
+        solver.support.array = np.array(state["support"], dtype="?")
+        pixel_size = float(state["pixel_size"])
+        solver.pixel_size = None if np.isnan(pixel_size) else pixel_size
+        solver.fourier_error = float(state["fourier_error"])
+        rng_state = json.loads(str(state["rng_state"]))
+        solver.rng = np.random.Generator(getattr(np.random, rng_state["bit_generator"])())
+        solver.rng.bit_generator.state = rng_state
+        if "metrics" in state:
+            solver.instrument(len(state["metrics"]))
+            solver.recorder.data[:] = state["metrics"]
+            solver.recorder.count = int(state["metrics_count"])
+        return solver
+
+    def set_diffraction(self, diffraction):
+        """
+        Swap in updated diffraction data of the same shape, e.g. as more frames arrive, without resetting anything.
+
+        The object, support and RNG carry on where they were, so the reconstruction keeps refining on the new data.
+        """
+        diffraction = np.asarray(diffraction, dtype=self.real_dtype)
+        if diffraction.shape != self._diffraction.shape:
+            raise ValueError(f"New diffraction shape {diffraction.shape} doesn't match {self._diffraction.shape}")
+        np.copyto(self._diffraction, np.fft.ifftshift(diffraction))
+        self._diffraction_norm = np.vdot(self._diffraction, self._diffraction).real
+        self.fourier_error = np.nan
 
     def set_scale(self, det_pitch, det_dist, wavelength):
         # The units get lumped into the 10**-6 term at the end: (10^-3 * 10^-9 / 10^-6) = 10^-6
@@ -30,62 +371,300 @@ class Solver:
         except (ZeroDivisionError, AssertionError):
             self.pixel_size = None
 
-    def run_recipe(self, recipe):
+    def run_recipe(self, text, beta=0.9, sigma=2.0, threshold=0.2, stop_error=None, check_every=10, callback=None):
+        """
+        Run a recipe such as "HIO:50, SW every 10, ER:20, repeat 5" without any GUI in the loop.
 
-        pass
+        The beta/sigma/threshold arguments are the defaults for steps that don't set their own. If stop_error is given,
+        the run ends early once the Fourier error drops below it. Returns the number of iterations performed.
+        """
+        program = recipe.compile_recipe(text, beta=beta, sigma=sigma, threshold=threshold)
+        return recipe.execute(self, program, stop_error, check_every, callback)
 
     def fft(self):
-        self.ds_prev = np.copy(self.ds_image)
-        self.fs_image = ut.fft(self.ds_image)
+        if self.lean:
+            raise ValueError("The step-by-step iteration needs separate buffers, which a lean Solver doesn't have")
+        np.copyto(self._ds_prev, self._ds)
+        self.engine.forward(self._ds, out=self._fs)
 
-    def modulus_constraint(self):
-        self.fs_image = self.diffraction * np.exp(1j * np.angle(self.fs_image))
+    def modulus_constraint(self, error=False):
+        # Replacing the modulus as D * F/|F| gives the same result as D * exp(i*angle(F)), minus the trig calls.
+        np.abs(self._fs, out=self._amp)
+        if error:
+            # sum((|F| - D)^2) expanded into reductions, so it needs no extra buffer
+            resid = np.vdot(self._amp, self._amp) - 2 * np.vdot(self._amp, self._diffraction) + self._diffraction_norm
+            self.fourier_error = resid / self._diffraction_norm
+        np.maximum(self._amp, EPSILON, out=self._amp)
+        np.divide(self._diffraction, self._amp, out=self._amp)
+        np.multiply(self._fs, self._amp, out=self._fs)
 
     def ifft(self):
-        self.ds_image = ut.ifft(self.fs_image)
+        self.engine.inverse(self._fs, out=self._ds)
 
     def er_constraint(self):
-        self.ds_image = self.ds_image * self.support.array + 0.0
+        self.project_support(self._ds)
 
     def er_iteration(self):
-        self.fft()
-        self.modulus_constraint()
-        self.ifft()
-        self.er_constraint()
+        self.iterate()
 
     def hio_constraint(self, beta=0.9):
-        self.ds_image = self.support.where(self.ds_image, self.ds_prev - beta*self.ds_image)
+        self.apply_hio(self._ds, self._ds_prev, beta)
 
     def hio_iteration(self, beta=0.9):
-        self.fft()
-        self.modulus_constraint()
-        self.ifft()
-        self.hio_constraint(beta)
+        self.iterate(beta)
+
+    def raar_iteration(self, beta=DEFAULT_BETAS["raar"]):
+        self.iterate(beta, algorithm="raar")
+
+    def dm_iteration(self, beta=DEFAULT_BETAS["dm"]):
+        self.iterate(beta, algorithm="dm")
+
+    def oss_iteration(self, beta=DEFAULT_BETAS["oss"], alpha=None, progress=0.0):
+        self.iterate(beta, algorithm="oss", alpha=alpha, progress=progress)
 
-    def shrinkwrap(self, sigma=1.0, threshold=0.1):
-        self.support.shrinkwrap(self.ds_image, sigma, threshold)
+    def iterate(self, beta=None, error=False, algorithm=None, **params):
+        """
+        Perform one fused iteration of any algorithm in ALGORITHMS: by default ER if beta is None, otherwise HIO.
+
+        Equivalent to fft -> modulus_constraint -> ifft -> constraint, but it only touches preallocated buffers.
+        Rather than copying the current image into ds_prev, the buffers are rotated at the end of the iteration. If
+        error is True, the Fourier error is updated from the modulus residual along the way.
+        """
+        step, beta = get_algorithm(algorithm, beta)
+        if self.lean and not any(step is ALGORITHMS[name] for name in LEAN_ALGORITHMS):
+            raise ValueError(f"A lean Solver can only run {sorted(LEAN_ALGORITHMS)}, not '{algorithm}'")
+        if self.recorder is not None:
+            return self._iterate_instrumented(step, beta, params)
+        step(self, beta, error, **params)
+        self._rotate()
+
+    def _rotate(self):
+        """Make the next estimate the current one, and the current one the previous one."""
+        if self.lean:
+            # The previous estimate is left in the shared buffer, which is overwritten by the next transform
+            self._ds, self._ds_next = self._ds_next, self._ds
+            self._fs = self._ds_prev = self._ds_next
+        else:
+            self._ds_prev, self._ds, self._ds_next = self._ds, self._ds_next, self._ds_prev
+
+    def instrument(self, capacity=10000):
+        """
+        Start recording errors, support size and per-stage timings for every iteration into a ring buffer.
+
+        Returns the metrics.Recorder. Pass capacity=None to turn the instrumentation back off; while it's off, the only
+        cost is one attribute check per iteration.
+        """
+        self.recorder = None if capacity is None else metrics.Recorder(capacity)
+        return self.recorder
+
+    def _iterate_instrumented(self, step, beta, params):
+        record = self.recorder.new_record()
+        self._record = record
+        self._untimed = 0.0
+        tic = time.perf_counter()
+        try:
+            step(self, beta, True, **params)
+        finally:
+            self._record = None
+        # Whatever isn't FFTs or the modulus projection is the constraint (minus the time spent on measurements)
+        elapsed = time.perf_counter() - tic - self._untimed
+        record["t_constraint"] = elapsed - record["t_fft"] - record["t_modulus"] - record["t_ifft"]
+        self._rotate()
+        record["fourier_error"] = self.fourier_error
+        record["support_size"] = self.support.window.count
+
+    def allocations_per_iteration(self, beta=0.9, n_iter=5):
+        """Measure the peak bytes allocated (and released) during a single fused iteration, averaged over n_iter."""
+        self.iterate(beta)  # warm up any lazily built plans
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        total = 0
+        try:
+            for _ in range(n_iter):
+                current, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                self.iterate(beta)
+                total += tracemalloc.get_traced_memory()[1] - current
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+        return total / n_iter
+
+    def shrinkwrap(self, sigma=1.0, threshold=0.1, method="auto"):
+        # The amplitude goes into _amp, which is free between iterations
+        if self.recorder is None:
+            self.support.shrinkwrap(self._ds, sigma, threshold, method, scratch=self._amp)
+            return
+        tic = time.perf_counter()
+        self.support.shrinkwrap(self._ds, sigma, threshold, method, scratch=self._amp)
+        record = self.recorder.latest()
+        if record is not None:
+            record["t_shrinkwrap"] += time.perf_counter() - tic
 
     def gaussian_blur(self, sigma=2.0):
-        self.ds_image = ut.normalize(ndi.gaussian_filter(np.abs(self.ds_image), sigma)) * \
-                        np.exp(1j * ndi.gaussian_filter(np.angle(self.ds_image), sigma))
+        # The whole estimate is blurred, outside the support as well: a one-off action, so it isn't worth restricting
+        # to the support's window (which would leave the rest unblurred).
+        self._ds[:] = ut.normalize(ut.gaussian_blur(np.abs(self._ds), sigma)) * \
+                      np.exp(1j * ut.gaussian_blur(np.angle(self._ds), sigma))
 
     def center(self):
-        row, col = ndi.center_of_mass(self.support.array)
-        rshift = int(self.ctr-row)
-        cshift = int(self.ctr-col)
-        self.support.array = np.roll(self.support.array, (rshift, cshift), axis=(0, 1))
-        self.ds_image = np.roll(self.ds_image, (rshift, cshift), axis=(0, 1))
+        # The support's center of mass along each axis, in centered coordinates, from the pieces of its window only
+        total, moments = 0, np.zeros(self.ndim)
+        axes = range(self.ndim)
+        for index in self.support.window.inside:
+            piece = self.support.array[index]
+            for axis, s in enumerate(index[1:]):
+                coords = (np.arange(s.start, s.stop) + self.shape[axis] // 2) % self.shape[axis]
+                moments[axis] += coords @ piece.sum(axis=tuple(a for a in axes if a != axis))
+            total += np.count_nonzero(piece)
+        if total == 0:
+            return
+        shifts = tuple(int(n // 2 - moment / total) for n, moment in zip(self.shape, moments))
+        # Rolling commutes with the FFT shift, so the unshifted arrays can be rolled directly. The object is rolled into
+        # _ds_next (free between iterations), which then takes its place, so no full-size copy is allocated.
+        self.support.array = np.roll(self.support.array, shifts, axis=tuple(axes))
+        ut.roll(self._ds, shifts, out=self._ds_next)
+        self._ds, self._ds_next = self._ds_next, self._ds
+        if self.lean:
+            self._fs = self._ds_prev = self._ds_next
 
     def remove_twin(self):
-        self.ds_image[self.ctr:] *= 0
-        self.ds_image[:, self.ctr:] *= 0
+        # Zero the second half of the centered image along each axis. In unshifted order that's the first n - n//2.
+        for axis, n in enumerate(self.shape):
+            self._ds[(slice(None),) * axis + (slice(0, n - n // 2),)] *= 0
+
+    def reset(self):
+        self.support = support.Support(self.shape)
+        self.support.array = np.fft.ifftshift(self.support.array)
+        random_phase(self.rng, self.shape, self.complex_dtype, out=self._fs, scratch=self._amp)
+        np.multiply(self._diffraction, self._fs, out=self._fs)
+        self.engine.inverse(self._fs, out=self._ds)
+        np.copyto(self._ds_prev, self._ds)
+
+
+class BatchSolver(Projectors):
+    """
+    Run many random starts of the same reconstruction at once.
+
+    All of the state lives in (n_starts, ...) stacks in unshifted order, and every projection is a single FFT batched
+    over the image (or volume) axes. The Fourier-space error of each start is updated as a by-product of the modulus
+    projection. The memory is planned as for a Solver (see memory.plan), but there's no lean layout.
+    """
+    def __init__(self, diffraction, n_starts=20, seed=None, precision=None, max_memory=None):
+        self.precision = ut.PRECISION if precision is None else precision
+        self.real_dtype, self.complex_dtype = ut.dtypes(self.precision)
+        diffraction = np.array(diffraction, dtype=self.real_dtype)
+        self.memory = memory.plan(diffraction.shape, self.precision, n_starts=n_starts, limit=max_memory)
+        self.shape = diffraction.shape
+        self.ndim = diffraction.ndim
+        self.imsize = self.shape[-1]
+        self.n_starts = n_starts
+        self.rng = np.random.default_rng(seed)
+        shape = (n_starts, *diffraction.shape)
+        self.axes = tuple(range(-self.ndim, 0))
+        self.engine = ut.get_engine(shape, self.complex_dtype, axes=self.axes)
+
+        self._diffraction = np.fft.ifftshift(diffraction)
+        self._diffraction_norm = np.sum(self._diffraction**2)
+        self._fs = self.engine.empty()
+        self._ds = self.engine.empty()
+        self._ds_prev = self.engine.empty()
+        self._ds_next = self.engine.empty()
+        self._amp = np.empty(shape, dtype=self._diffraction.real.dtype)
+        self._resid = np.empty(shape, dtype=self._diffraction.real.dtype)
+        self._outside = np.empty(shape, dtype="?")
+        self.support = np.empty(shape, dtype="?")
+        self.fourier_error = np.full(n_starts, np.nan)
+        self._oss_filter = None
+        self.reset()
+
+    @property
+    def fs_images(self):
+        return np.fft.fftshift(self._fs, axes=self.axes)
+
+    @property
+    def ds_images(self):
+        return np.fft.fftshift(self._ds, axes=self.axes)
+
+    @property
+    def support_images(self):
+        return np.fft.fftshift(self.support, axes=self.axes)
+
+    @property
+    def _support_mask(self):
+        return self.support
 
     def reset(self):
-        self.support = support.Support2D(self.imsize)
-        self.fs_image = self.diffraction * np.exp(2j * np.pi * np.random.random((self.imsize, self.imsize))) + 0.0
-        self.ds_image = ut.ifft(self.fs_image)
-        self.ds_prev = np.copy(self.ds_image)
+        self.support[:] = np.fft.ifftshift(support.Support(self.shape).array)
+        self._support_window = support.Window(self.support, ndim=self.ndim)
+        # In place, like Solver.reset, so that a reset doesn't allocate several stacks' worth of temporaries
+        random_phase(self.rng, self._fs.shape, self.complex_dtype, out=self._fs, scratch=self._amp)
+        np.multiply(self._diffraction, self._fs, out=self._fs)
+        self.engine.inverse(self._fs, out=self._ds)
+        np.copyto(self._ds_prev, self._ds)
+        self.fourier_error[:] = np.nan
+
+    def modulus_constraint(self, error=True):
+        np.abs(self._fs, out=self._amp)
+        if error:
+            np.subtract(self._amp, self._diffraction, out=self._resid)
+            resid = self._resid.reshape(self.n_starts, -1)
+            self.fourier_error[:] = np.einsum("ij,ij->i", resid, resid) / self._diffraction_norm
+        np.maximum(self._amp, EPSILON, out=self._amp)
+        np.divide(self._diffraction, self._amp, out=self._amp)
+        np.multiply(self._fs, self._amp, out=self._fs)
+
+    def iterate(self, beta=None, error=True, algorithm=None, **params):
+        """Perform one fused iteration on every start: ER (beta=None), HIO, or any other algorithm in ALGORITHMS."""
+        step, beta = get_algorithm(algorithm, beta)
+        step(self, beta, error, **params)
+        self._ds_prev, self._ds, self._ds_next = self._ds, self._ds_next, self._ds_prev
+
+    def er_iteration(self):
+        self.iterate()
+
+    def hio_iteration(self, beta=0.9):
+        self.iterate(beta)
+
+    def shrinkwrap(self, sigma=1.0, threshold=0.1, method="auto"):
+        # Same as Support.shrinkwrap, but normalized independently for each start
+        blurred = ut.gaussian_blur(np.abs(self._ds), sigma, method, ndim=self.ndim)
+        ut.threshold(blurred, threshold, out=self.support, ndim=self.ndim)
+        # A single window for all of the starts, covering every one of their supports
+        self._support_window = support.Window(self.support, ndim=self.ndim)
+
+    def support_error(self):
+        """Fraction of each start's real-space energy that lies outside its support."""
+        energy = np.abs(self._ds)**2
+        np.logical_not(self.support, out=self._outside)
+        outside = self._outside.reshape(self.n_starts, -1)
+        return np.einsum("ij,ij->i", energy.reshape(self.n_starts, -1), outside) / energy.sum(axis=self.axes)
+
+    def errors(self):
+        return {
+            "fourier": self.fourier_error.copy(),
+            "support": self.support_error(),
+            "support_size": self.support.sum(axis=self.axes),
+        }
+
+    def run_recipe(self, text, beta=0.9, sigma=2.0, threshold=0.2, stop_error=None, check_every=10, callback=None):
+        """Same as Solver.run_recipe; early stopping happens once the best start's error drops below stop_error."""
+        program = recipe.compile_recipe(text, beta=beta, sigma=sigma, threshold=threshold)
+        return recipe.execute(self, program, stop_error, check_every, callback)
+
+    def best(self, metric="fourier"):
+        """Index of the start with the lowest value of the given error metric."""
+        return int(np.nanargmin(self.errors()[metric]))
 
+    def to_solver(self, index=None):
+        """Copy one start (the best one by default) into a regular Solver, e.g. to continue it in the GUI."""
+        if index is None:
+            index = self.best()
+        solver = Solver(np.fft.fftshift(self._diffraction), precision=self.precision)
+        np.copyto(solver._fs, self._fs[index])
+        np.copyto(solver._ds, self._ds[index])
+        np.copyto(solver._ds_prev, self._ds_prev[index])
+        solver.support.array = self.support[index].copy()
+        return solver
 
-if __name__ == "__main__":
-    pass
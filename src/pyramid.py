@@ -0,0 +1,85 @@
+"""
+Coarse-to-fine (multiresolution) phasing.
+
+The center of a diffraction pattern is a low-resolution view of the whole object: cropping it to half the size keeps the
+field of view and doubles the real-space pixel size, at a quarter (for a volume, an eighth) of the cost per iteration.
+A pyramid runs most of its iterations on such crops, then carries the object up to the next level by zero-padding its
+Fourier transform (i.e. sinc interpolation, so its transform still matches the low-q data exactly) and interpolates the
+support the same way. Each level's Solver starts from there instead of from a random phase.
+
+Usage: python -m src.recipe [data.tif] "HIO:50, SW every 10, ER:20" --levels 3
+"""
+import numpy as np
+
+import src.utils as ut
+from src.phasing import Solver
+
+
+LEVELS = 3
+MIN_SIZE = 32
+COARSE_RECIPE = "HIO:200, SW every 5, ER:20"
+
+
+def level_shapes(shape, n_levels=LEVELS, min_size=MIN_SIZE):
+    """The shape of each level, coarse to fine: the full shape, halved (to even sizes) until n_levels."""
+    shapes = [tuple(shape)]
+    while len(shapes) < n_levels and min(shapes[-1]) // 4 * 2 >= min_size:
+        shapes.append(tuple(n // 4 * 2 for n in shapes[-1]))
+    return shapes[::-1]
+
+
+def crop_center(image, shape):
+    """The central pixels of a centered image (or volume), keeping the center pixel where pad_to_size puts it back."""
+    return image[tuple(slice(n // 2 - m // 2, n // 2 - m // 2 + m) for n, m in zip(image.shape, shape))]
+
+
+def fourier_upsample(image, shape):
+    """Interpolate a centered image onto a finer grid over the same field of view, by zero-padding its spectrum."""
+    return ut.ifft(ut.pad_to_size(ut.fft(image), shape)) * np.prod(np.divide(shape, image.shape))
+
+
+def upsample(solver, diffraction, max_memory=None):
+    """A Solver for a larger crop of the diffraction pattern, starting from a coarser solver's object and support."""
+    finer = Solver(diffraction, precision=solver.precision, max_memory=max_memory)
+    finer.rng = solver.rng
+    # The transform of the object is kept as it was, zero-padded, since the finer level's data match it at low q. (Over
+    # more pixels, that makes the object itself fainter than fourier_upsample would.)
+    finer.ds_image = ut.ifft(ut.pad_to_size(ut.fft(solver.ds_image), finer.shape))
+    mask = fourier_upsample(solver.support_image.astype(finer.real_dtype), finer.shape).real > 0.5
+    finer.support.array = np.fft.ifftshift(mask)
+    np.copyto(finer._ds_prev, finer._ds)
+    finer.engine.forward(finer._ds, out=finer._fs)
+    return finer
+
+
+def run_pyramid(diffraction, recipes, seed=None, precision=None, sigma=2.0, callback=None, max_memory=None, **kwargs):
+    """
+    Run one recipe per level, coarse to fine, each level starting from the result of the one before. A recipe of None
+    only sets up its level, e.g. to leave the full-resolution iterations to the caller.
+
+    Returns the full-resolution Solver and the number of iterations run at each level. If the pattern is too small for
+    that many levels, the coarsest recipes are dropped. The default shrinkwrap sigma is in full-resolution pixels, and
+    is scaled down with each level so that it blurs the same physical width. Every level's Solver is planned within
+    max_memory bytes (see Solver). Other keyword arguments go to run_recipe.
+    """
+    diffraction = np.asarray(diffraction)
+    shapes = level_shapes(diffraction.shape, len(recipes))
+    solver = None
+    counts = []
+    for shape, text in zip(shapes, recipes[len(recipes) - len(shapes):]):
+        level = crop_center(diffraction, shape)
+        if solver is None:
+            solver = Solver(level, seed=seed, precision=precision, max_memory=max_memory)
+        else:
+            solver = upsample(solver, level, max_memory)
+        if text is None:
+            counts.append(0)
+            continue
+        counts.append(solver.run_recipe(text, sigma=sigma * shape[-1] / shapes[-1][-1], callback=callback, **kwargs))
+    return solver, counts
+
+
+def coarse_start(diffraction, recipe=COARSE_RECIPE, n_levels=LEVELS, seed=None, precision=None, **kwargs):
+    """A full-resolution Solver seeded by running the recipe at each of the n_levels - 1 coarser levels."""
+    solver, _ = run_pyramid(diffraction, [recipe] * (n_levels - 1) + [None], seed=seed, precision=precision, **kwargs)
+    return solver
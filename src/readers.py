@@ -0,0 +1,184 @@
+"""
+Lazy readers for diffraction data files.
+
+Every reader returns a sequence of frames without decoding them up front:
+    * uncompressed TIFFs (single or multi-page) are memory-mapped strip by strip, straight from the file,
+    * .npy files are memory-mapped with np.load(mmap_mode="r"),
+    * HDF5 detector datasets are read frame by frame through h5py (an optional dependency),
+    * anything else (compressed TIFF pages, PNG, ...) falls back to decoding with PIL, one frame at a time.
+
+For 3D data, open_volume returns each file's volume as a single (lazy) frame instead.
+"""
+import struct
+from pathlib import Path
+
+import numpy as np
+
+
+HDF5_SUFFIXES = {".h5", ".hdf5", ".hdf", ".nxs", ".cxi"}
+# Common locations of the detector frames in HDF5 files (NeXus, CXI), checked before searching the whole file
+HDF5_DATASETS = ["entry/data/data", "entry_1/data_1/data", "entry/instrument/detector/data", "data"]
+
+# TIFF tag numbers
+WIDTH, LENGTH, BITS, COMPRESSION, STRIP_OFFSETS, SAMPLES, STRIP_COUNTS, PLANAR, TILE_WIDTH, SAMPLE_FORMAT = \
+    256, 257, 258, 259, 273, 277, 279, 284, 322, 339
+TIFF_TYPES = {1: "B", 3: "H", 4: "I", 6: "b", 8: "h", 9: "i", 16: "Q"}  # BYTE, SHORT, LONG, SBYTE, SSHORT, SLONG, LONG8
+SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+def load_h5py():
+    """Import h5py on first use, since it's slow to import and optional. Returns None if it isn't installed."""
+    try:
+        import h5py
+    except ImportError:
+        return None
+    return h5py
+
+
+def _pil_open(filepath):
+    from PIL import Image  # only the formats that aren't memory-mapped need PIL
+    return Image.open(filepath)
+
+
+class PILPage:
+    """A single page of an image file, decoded by PIL only when it's converted to an array."""
+    def __init__(self, filepath, index=0):
+        self.filepath = filepath
+        self.index = index
+
+    def __array__(self, dtype=None, copy=None):
+        with _pil_open(self.filepath) as img:
+            img.seek(self.index)
+            arr = np.asarray(img)
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def _tiff_ifds(f):
+    """Parse the header and every image file directory of a (classic, not Big-) TIFF. Returns (byte order, IFDs)."""
+    order = {b"II": "<", b"MM": ">"}.get(f.read(2))
+    if order is None or struct.unpack(order + "H", f.read(2))[0] != 42:
+        return None, []
+    ifds = []
+    offset = struct.unpack(order + "I", f.read(4))[0]
+    while offset:
+        f.seek(offset)
+        n_entries = struct.unpack(order + "H", f.read(2))[0]
+        tags = {}
+        for tag, typ, count, value in struct.iter_unpack(order + "HHI4s", f.read(12 * n_entries)):
+            if typ not in TIFF_TYPES:
+                continue
+            fmt = order + str(count) + TIFF_TYPES[typ]
+            size = struct.calcsize(fmt)
+            if size <= 4:
+                values = struct.unpack(fmt, value[:size])
+            else:
+                here = f.tell()
+                f.seek(struct.unpack(order + "I", value)[0])
+                values = struct.unpack(fmt, f.read(size))
+                f.seek(here)
+            tags[tag] = values
+        ifds.append(tags)
+        offset = struct.unpack(order + "I", f.read(4))[0]
+    return order, ifds
+
+
+def _tiff_page(filepath, order, tags, index):
+    """Memory-map one TIFF page if its pixels are stored raw and contiguous, otherwise fall back to PIL."""
+    offsets = tags.get(STRIP_OFFSETS, ())
+    counts = tags.get(STRIP_COUNTS, ())
+    samples = tags.get(SAMPLES, (1,))[0]
+    bits = set(tags.get(BITS, (1,)))
+    kind = SAMPLE_KINDS.get(tags.get(SAMPLE_FORMAT, (1,))[0])
+    raw = (tags.get(COMPRESSION, (1,))[0] == 1 and TILE_WIDTH not in tags and tags.get(PLANAR, (1,))[0] == 1
+           and len(bits) == 1 and min(bits) in (8, 16, 32, 64) and kind is not None and offsets
+           and all(o + c == o_next for o, c, o_next in zip(offsets, counts, offsets[1:])))
+    if not raw:
+        return PILPage(filepath, index)
+    dtype = np.dtype(f"{order}{kind}{min(bits) // 8}")
+    shape = (tags[LENGTH][0], tags[WIDTH][0]) + ((samples,) if samples > 1 else ())
+    return np.memmap(filepath, dtype=dtype, mode="r", offset=offsets[0], shape=shape)
+
+
+def open_tiff(filepath):
+    with open(filepath, "rb") as f:
+        order, ifds = _tiff_ifds(f)
+    if not ifds:
+        # Not a classic TIFF (e.g. BigTIFF), so let PIL deal with it
+        with _pil_open(filepath) as img:
+            return [PILPage(filepath, i) for i in range(getattr(img, "n_frames", 1))]
+    return [_tiff_page(filepath, order, tags, i) for i, tags in enumerate(ifds)]
+
+
+def open_npy(filepath):
+    arr = np.load(filepath, mmap_mode="r")
+    # A 3D array is a stack of frames, unless the last axis looks like color channels
+    if arr.ndim == 2 or (arr.ndim == 3 and arr.shape[-1] in (3, 4)):
+        return [arr]
+    return arr
+
+
+def open_hdf5(filepath, dataset=None):
+    h5py = load_h5py()
+    if h5py is None:
+        raise ImportError(f"Reading {Path(filepath).name} requires h5py, which is not installed (pip install h5py)")
+    f = h5py.File(filepath, "r")
+    if dataset is None:
+        dataset = next((name for name in HDF5_DATASETS if isinstance(f.get(name), h5py.Dataset)), None)
+    if dataset is None:
+        found = []
+        f.visititems(lambda name, obj: found.append(name) if isinstance(obj, h5py.Dataset) and obj.ndim >= 2 else None)
+        if not found:
+            raise ValueError(f"No image dataset found in {filepath}")
+        dataset = found[0]
+    data = f[dataset]
+    # h5py reads a frame from disk each time one is indexed, so the dataset itself is the lazy sequence of frames.
+    return [data] if data.ndim == 2 else data
+
+
+def open_frames(filepath, dataset=None):
+    """Return the frames in a file as a sequence of lazily loaded 2D arrays (or array-likes)."""
+    suffix = Path(filepath).suffix.lower()
+    if suffix in (".tif", ".tiff"):
+        return open_tiff(filepath)
+    if suffix == ".npy":
+        return open_npy(filepath)
+    if suffix in HDF5_SUFFIXES:
+        return open_hdf5(filepath, dataset)
+    with _pil_open(filepath) as img:
+        return [PILPage(filepath, i) for i in range(getattr(img, "n_frames", 1))]
+
+
+class PageStack:
+    """The pages of a multi-page file as one volume, read only when it's converted to an array."""
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.stack([np.asarray(page) for page in self.pages])
+        return arr if dtype is None else arr.astype(dtype)
+
+
+def open_volume(filepath, dataset=None):
+    """
+    Return the 3D volume in a file as a one-frame sequence, so that it can be passed to accumulate() as a reader: an
+    .npy array or HDF5 dataset as a whole (including a stack of frames), or the pages of a multi-page image stacked.
+    """
+    suffix = Path(filepath).suffix.lower()
+    if suffix == ".npy":
+        volume = np.load(filepath, mmap_mode="r")
+    elif suffix in HDF5_SUFFIXES:
+        frames = open_hdf5(filepath, dataset)
+        volume = frames[0] if isinstance(frames, list) else frames
+    else:
+        pages = open_frames(filepath)
+        if len(pages) < 2:
+            raise ValueError(f"{Path(filepath).name} has a single page, not a 3D volume")
+        return [PageStack(pages)]
+    if volume.ndim != 3:
+        raise ValueError(f"{Path(filepath).name} holds a {volume.ndim}D array, not a 3D volume")
+    return [volume]
+
+
+def read_frame(filepath, index=0):
+    """Read a single frame from a file into memory."""
+    return np.asarray(open_frames(filepath)[index])
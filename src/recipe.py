@@ -0,0 +1,244 @@
+"""
+A small recipe language for running reconstructions without the GUI.
+
+A recipe is a list of steps separated by commas, semicolons or newlines, e.g. "HIO:50, SW every 10, ER:20, repeat 5":
+
+    HIO:n [beta=b]                  n iterations of hybrid input-output
+    ER:n                            n iterations of error reduction
+    RAAR:n [beta=b]                 n iterations of relaxed averaged alternating reflections
+    DM:n [beta=b]                   n iterations of the difference map
+    OSS:n [beta=b] [alpha=a]        n iterations of oversampling smoothness; without alpha, the filter is narrowed
+                                    from N to 1/N pixels in OSS_STAGES stages
+    SW [every k] [sigma=s] [threshold=t]
+                                    shrinkwrap once, or every k iterations of the preceding iterative step
+    CENTER, TWIN, BLUR [sigma=s]    re-center, remove the twin, or blur the object once
+    repeat n                        repeat everything since the previous "repeat" (or the start) n times
+
+Names are case-insensitive. A recipe is compiled into a flat list of operations so that execution is a tight loop.
+
+Usage: python -m src.recipe [data.tif] "HIO:50, SW every 10, ER:20, repeat 5" --output result.npz
+"""
+import re
+import time
+
+import numpy as np
+
+
+ITERATIONS = {"HIO", "ER", "RAAR", "DM", "OSS"}
+ONE_SHOTS = {"SW": "shrinkwrap", "CENTER": "center", "TWIN": "remove_twin", "BLUR": "gaussian_blur"}
+PARAMS = {"HIO": {"beta"}, "ER": set(), "RAAR": {"beta"}, "DM": {"beta"}, "OSS": {"beta", "alpha"},
+          "SW": {"sigma", "threshold"}, "BLUR": {"sigma"}, "CENTER": set(), "TWIN": set()}
+
+STEP = re.compile(r"^(?P<name>[a-z]+)\s*(?::\s*(?P<count>\d+))?(?:\s+every\s+(?P<every>\d+))?"
+                  r"(?P<params>(?:\s+\w+=\S+)*)$", re.IGNORECASE)
+OSS_STAGES = 10  # an OSS step without alpha runs in this many stages, each with a narrower filter
+
+
+class RecipeError(ValueError):
+    pass
+
+
+def parse_recipe(text):
+    """Split a recipe into a list of (name, count, every, params) tuples, checking the syntax as it goes."""
+    steps = []
+    for raw in re.split(r"[,;\n]", text):
+        raw = raw.strip()
+        if not raw:
+            continue
+        if raw.lower().startswith("repeat"):
+            try:
+                times = int(raw.split()[1])
+            except (IndexError, ValueError):
+                raise RecipeError(f"Expected 'repeat <n>', got '{raw}'")
+            if times < 1:
+                raise RecipeError(f"A block has to be repeated at least once ('{raw}')")
+            steps.append(("REPEAT", times, None, {}))
+            continue
+        match = STEP.match(raw)
+        if match is None:
+            raise RecipeError(f"Could not parse recipe step '{raw}'")
+        name = match["name"].upper()
+        if name not in PARAMS:
+            raise RecipeError(f"Unknown recipe step '{match['name']}'")
+        count = None if match["count"] is None else int(match["count"])
+        every = None if match["every"] is None else int(match["every"])
+        if name in ITERATIONS and count is None:
+            raise RecipeError(f"'{raw}' needs an iteration count, e.g. '{name}:50'")
+        if name not in ITERATIONS and count is not None:
+            raise RecipeError(f"'{raw}' doesn't take an iteration count")
+        if every is not None and name != "SW":
+            raise RecipeError(f"Only SW can be applied 'every' k iterations ('{raw}')")
+        if every == 0:
+            raise RecipeError(f"SW has to be applied every 1 or more iterations ('{raw}')")
+        params = {}
+        for item in match["params"].split():
+            key, value = item.split("=", 1)
+            if key.lower() not in PARAMS[name]:
+                raise RecipeError(f"{name} doesn't have a parameter '{key}'")
+            try:
+                params[key.lower()] = float(value)
+            except ValueError:
+                raise RecipeError(f"{name}'s parameter '{key}' has to be a number, got '{value}'")
+        steps.append((name, count, every, params))
+    return steps
+
+
+def compile_recipe(text, beta=0.9, sigma=2.0, threshold=0.2):
+    """
+    Compile a recipe into a flat program. Each operation is either
+        ("iterate", n, algorithm, params, sw_every, sw_kwargs, offset), where params are passed on to the algorithm and
+            offset counts the iterations of the same step that come before it (an OSS step compiles into several), or
+        ("call", method_name, kwargs), for one-shot operations.
+    """
+    program = []
+    block_start = 0
+    step_start = 0  # where the operations of the latest iterative step start (OSS can compile into several)
+    for name, count, every, params in parse_recipe(text):
+        if name == "REPEAT":
+            block = program[block_start:]
+            program.extend(block * (count - 1))
+            block_start = len(program)
+        elif name in ITERATIONS:
+            step_start = len(program)
+            step_params = {} if name == "ER" else {"beta": params.get("beta", beta)}
+            if name == "OSS" and "alpha" not in params:
+                # Split the run into stages with successively narrower filters
+                for stage in range(OSS_STAGES):
+                    offset = count * stage // OSS_STAGES
+                    n = count * (stage + 1) // OSS_STAGES - offset
+                    if n:
+                        progress = stage / (OSS_STAGES - 1)
+                        program.append(("iterate", n, "oss", {**step_params, "progress": progress}, 0, {}, offset))
+            else:
+                step_params.update({"alpha": params["alpha"]} if "alpha" in params else {})
+                program.append(("iterate", count, name.lower(), step_params, 0, {}, 0))
+        elif name == "SW" and every is not None:
+            if not program or program[-1][0] != "iterate":
+                raise RecipeError("'SW every k' must follow an iterative step such as HIO or ER")
+            sw_kwargs = {"sigma": params.get("sigma", sigma), "threshold": params.get("threshold", threshold)}
+            for i in range(step_start, len(program)):
+                program[i] = program[i][:4] + (every, sw_kwargs, program[i][6])
+        elif name == "SW":
+            program.append(("call", "shrinkwrap", {"sigma": params.get("sigma", sigma),
+                                                   "threshold": params.get("threshold", threshold)}))
+        else:
+            program.append(("call", ONE_SHOTS[name], params))
+    return program
+
+
+def execute(solver, program, stop_error=None, check_every=10, callback=None):
+    """
+    Run a compiled program on a Solver (or BatchSolver). Returns the number of iterations performed.
+
+    The Fourier error is only computed on the last iteration, and every check_every iterations if it's needed for early
+    stopping or the callback, which is called as callback(solver, n_iterations).
+    """
+    checking = stop_error is not None or callback is not None
+    total = sum(op[1] for op in program if op[0] == "iterate")
+    done = 0
+    for op in program:
+        if op[0] == "call":
+            _, method, kwargs = op
+            if not hasattr(solver, method):
+                raise RecipeError(f"{type(solver).__name__} doesn't support '{method}'")
+            getattr(solver, method)(**kwargs)
+            continue
+        _, n, algorithm, params, sw_every, sw_kwargs, offset = op
+        for i in range(1, n + 1):
+            check = checking and (done + i) % check_every == 0
+            solver.iterate(error=check or done + i == total, algorithm=algorithm, **params)
+            # Shrinkwrap every sw_every iterations of the whole step, not of each of its stages
+            if sw_every and (offset + i) % sw_every == 0:
+                solver.shrinkwrap(**sw_kwargs)
+            if check:
+                if callback is not None:
+                    callback(solver, done + i)
+                if stop_error is not None and np.min(solver.fourier_error) < stop_error:
+                    return done + i
+        done += n
+    return done
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.diffraction import LoadData, INIT_DATA
+    from src.export import snapshot, write_bundle
+    from src.cache import ResultCache, result_key
+    from src.checkpoint import AutoCheckpoint, DEFAULT_EVERY, load
+    from src.phasing import Solver
+    from src.pyramid import COARSE_RECIPE, coarse_start
+    from src.utils import PRECISION, PRECISIONS
+
+    parser = argparse.ArgumentParser(description="Run a phase retrieval recipe without the GUI.")
+    parser.add_argument("data", nargs="?", default=INIT_DATA, help="diffraction image file")
+    parser.add_argument("recipe", nargs="?", default="HIO:50, SW every 1, ER:10, repeat 4")
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("-p", "--precision", choices=list(PRECISIONS), default=PRECISION)
+    parser.add_argument("--stop-error", type=float, default=None)
+    parser.add_argument("--metrics", default=None, help="record per-iteration metrics to this CSV file")
+    parser.add_argument("--resume", default=None, help="continue from this checkpoint instead of starting from data")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint the solver state to this file while running")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_EVERY)
+    parser.add_argument("--levels", type=int, default=1,
+                        help="start from this many resolution levels, running --coarse on each level below full size")
+    parser.add_argument("--coarse", default=COARSE_RECIPE, help="recipe for each coarse level (with --levels)")
+    parser.add_argument("--volume", action="store_true", help="the data are 3D volumes (e.g. Bragg CDI)")
+    parser.add_argument("--max-memory", type=float, default=None,
+                        help="cap the solver's planned memory at this many GiB (default: most of the available memory)")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse the cached result of the same data, preprocessing, recipe and seed, or cache this "
+                             "one (only with --seed, since other runs aren't reproducible)")
+    parser.add_argument("-o", "--output", default="result.npz", help="result bundle (.npz, or .h5 with h5py)")
+    args = parser.parse_args()
+
+    ndim = 3 if args.volume else 2
+    max_memory = None if args.max_memory is None else int(args.max_memory * 2**30)
+    params = {"data": args.data, "recipe": args.recipe, "seed": args.seed, "precision": args.precision,
+              "resumed_from": args.resume, "volume": args.volume, "levels": args.levels,
+              "coarse": args.coarse if args.levels > 1 else None}
+    cache = key = cached = None
+    if args.resume is not None:
+        solver, resumed = load(args.resume)
+        start = resumed.get("iterations", 0)
+        params["precision"] = solver.precision
+    else:
+        data = LoadData(args.data, args.precision, ndim)
+        diffraction = data.preprocess()
+        start = 0
+        if args.cache and args.seed is not None:
+            cache = ResultCache()
+            key = result_key(data.last_key, stop_error=args.stop_error,
+                             **{name: params[name] for name in ["recipe", "seed", "precision", "levels", "coarse"]})
+            cached = cache.get(key)
+        if cached is not None:
+            solver, _ = cached
+        elif args.levels > 1:
+            solver = coarse_start(diffraction, args.coarse, args.levels, seed=args.seed, precision=args.precision,
+                                  max_memory=max_memory)
+        else:
+            solver = Solver(diffraction, seed=args.seed, precision=args.precision, max_memory=max_memory)
+    if args.volume or args.max_memory is not None:
+        print(solver.memory.report())
+    if cached is not None:
+        write_bundle(args.output, snapshot(solver, cached[1]))
+        print(f"Cached result ({cached[1]['iterations']} iterations) from {cache.path(key)}, saved to {args.output}")
+        raise SystemExit
+    if args.metrics is not None and solver.recorder is None:
+        solver.instrument()
+    autosave = None
+    if args.checkpoint is not None:
+        autosave = AutoCheckpoint(args.checkpoint, args.checkpoint_every, params={**params, "start_iterations": start})
+    tic = time.perf_counter()
+    n_iter = solver.run_recipe(args.recipe, stop_error=args.stop_error, callback=autosave,
+                               check_every=args.checkpoint_every if autosave is not None else 10)
+    elapsed = time.perf_counter() - tic
+    if autosave is not None:
+        autosave.save_now(solver, n_iter).result()
+    write_bundle(args.output, snapshot(solver, {**params, "iterations": start + n_iter}))
+    if cache is not None:
+        cache.store(key, solver, {**params, "iterations": start + n_iter})
+    print(f"{n_iter} iterations in {elapsed:.2f} s ({n_iter / elapsed:.1f} it/s), saved to {args.output}")
+    if args.metrics is not None:
+        solver.recorder.to_csv(args.metrics)
+        for key, value in solver.recorder.summary().items():
+            print(f"  {key:>14}: {value:.4g}")
@@ -0,0 +1,103 @@
+"""
+Timing the startup of the live GUI.
+
+The GUI marks each milestone of its startup on a Milestones object, in seconds since src.cdi_live started executing:
+    "imports"   everything imported, before any window exists
+    "window"    the window is on screen (with empty images)
+    "canvases"  the image canvases are built, which is when matplotlib gets imported
+    "ready"     the example data are loaded (on a background thread) and drawn
+
+The modules in DEFERRED are slow to import and only needed once there's something to show or compute, so none of them
+should have been imported by the time the window appears. Each milestone records which ones had been, which is how a
+stray top-level import shows up.
+
+Usage:
+    python src/cdi_live.py --startup-report
+    python -m src.benchmark --startup
+"""
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+DEFERRED = ["matplotlib", "scipy.ndimage", "scipy.sparse", "PIL.Image", "h5py"]
+# The time to each milestone that a cold start should stay within, on a typical desktop
+BUDGET_S = {"imports": 1.0, "window": 1.5, "ready": 4.0}
+ROOT = Path(__file__).parents[1]
+
+
+class Milestones:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.times = {}
+        self.imported = {}  # the DEFERRED modules already imported at each milestone
+
+    def mark(self, name):
+        self.times[name] = time.perf_counter() - self.start
+        self.imported[name] = [module for module in DEFERRED if module in sys.modules]
+
+    def to_dict(self):
+        return {"times": self.times, "imported": self.imported}
+
+    def report(self):
+        lines = ["Startup (seconds since src.cdi_live started):"]
+        for name, seconds in self.times.items():
+            budget = BUDGET_S.get(name)
+            verdict = "" if budget is None else f"  (budget {budget:.1f} s{', OVER' if seconds > budget else ''})"
+            lines.append(f"  {name:<10}{seconds:8.3f} s{verdict}")
+        if "window" in self.imported:
+            lines.append(f"Imported before the window appeared: {', '.join(self.imported['window']) or 'none'} "
+                         f"(of {', '.join(DEFERRED)})")
+        return "\n".join(lines)
+
+
+def _run(args, timeout):
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, cwd=ROOT, timeout=timeout)
+
+
+def measure_import():
+    """The milestones of importing src.cdi_live in a fresh interpreter, i.e. without showing anything."""
+    code = "import json, src.cdi_live as app; print(json.dumps(app.STARTUP.to_dict()))"
+    result = _run(["-c", code], timeout=60)
+    result.check_returncode()
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def measure_gui(timeout=60):
+    """
+    The milestones of a full startup of the GUI, which quits as soon as it's ready. Returns None if the GUI can't run
+    here, e.g. without a display.
+    """
+    try:
+        result = _run([str(ROOT / "src" / "cdi_live.py"), "--startup-report", "json", "--exit-when-ready"], timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def import_profile(module="src.cdi_live", top=10):
+    """
+    The slowest imports under a module, from python -X importtime in a fresh interpreter: (name, cumulative seconds)
+    for the modules it imports directly, slowest first.
+    """
+    result = _run(["-X", "importtime", "-c", f"import {module}"], timeout=60)
+    result.check_returncode()
+    # A module's line comes after those of everything it imports, which are indented by two more spaces
+    pending, direct = [], []
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            pending.append((name.strip(), int(fields[1]) / 1e6))
+        elif depth == 1:
+            if name.strip() == module:
+                direct = pending
+            pending = []
+    return sorted(direct, key=lambda item: -item[1])[:top]
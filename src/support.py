@@ -1,21 +1,120 @@
+import itertools
+
 import numpy as np
-import scipy.ndimage as ndi
 
 import src.utils as ut
 
 
-class Support2D:
-    def __init__(self, size, initial_oversampling=1.75):
-        self.array = np.zeros((size, size), dtype="?")
-        corner = int(round(size * (1 - 1 / initial_oversampling) / 2))
-        self.array[corner:-corner, corner:-corner] = True
+def circular_span(occupied):
+    """
+    The (start, length) of the shortest run of indices that covers every True entry of a 1D array, where runs can wrap
+    around the end. In unshifted (FFT) order the object sits across the edges, so a plain bounding box is no use.
+    """
+    n = occupied.size
+    idx = np.flatnonzero(occupied)
+    if idx.size == 0:
+        return 0, 0
+    # The run starts right after the largest gap between consecutive entries (counting the gap across the end)
+    gaps = np.diff(idx, append=idx[0] + n)
+    k = int(np.argmax(gaps))
+    if gaps[k] == 1:
+        return 0, n
+    return int(idx[(k + 1) % idx.size]), int(n - gaps[k] + 1)
+
+
+def _split(start, length, n):
+    """The slices that make up a (possibly wrapped) run of indices, and the slices for the rest of the axis."""
+    end = start + length
+    if length == 0:
+        inside, outside = [], [slice(0, n)]
+    elif end <= n:
+        inside, outside = [slice(start, end)], [slice(0, start), slice(end, n)]
+    else:
+        inside, outside = [slice(start, n), slice(0, end - n)], [slice(end - n, start)]
+    return [s for s in inside if s.start < s.stop], [s for s in outside if s.start < s.stop]
+
+
+class Window:
+    """
+    The bounding box of a mask over its last ndim axes (default 2), allowing for wrap-around, and shared by any leading
+    axes.
+
+    Pieces of it are given as index tuples: `inside` for the (up to 2**ndim) blocks that make up the box, and `bands`
+    and `outside_bands` for the slabs through the box and beyond it along the first of those axes, full-size along the
+    others. A band is contiguous in memory, which matters for masked ufuncs: on strided pieces they're several times
+    slower. `count` is the number of True entries.
+    """
+    def __init__(self, mask, ndim=2):
+        self.shape = mask.shape[-ndim:]
+        axes = tuple(range(-ndim, 0))
+        lead = tuple(range(mask.ndim - ndim))
+        self.spans = [circular_span(mask.any(axis=lead + axes[:i] + axes[i + 1:])) for i in range(ndim)]
+        splits = [_split(*span, n) for span, n in zip(self.spans, self.shape)]
+        rest = (slice(None),) * (ndim - 1)
+        self.inside = [(Ellipsis,) + block for block in itertools.product(*(inside for inside, _ in splits))]
+        self.bands = [(Ellipsis, slab) + rest for slab in splits[0][0]]
+        self.outside_bands = [(Ellipsis, slab) + rest for slab in splits[0][1]]
+        self.count = sum(int(np.count_nonzero(mask[index])) for index in self.inside)
+
+    @property
+    def size(self):
+        return int(np.prod([length for _, length in self.spans]))
+
+    def indices(self, margin=0):
+        """Index arrays (one per axis) covering the box grown by a margin on every side, for np.ix_."""
+        return [np.arange(start - margin, start + length + margin) % n if length + 2 * margin < n else np.arange(n)
+                for (start, length), n in zip(self.spans, self.shape)]
+
 
-    def shrinkwrap(self, image, sigma=1.0, threshold=0.1):
-        self.array = ut.normalize(ndi.gaussian_filter(np.abs(image), sigma)) > threshold
+class Support:
+    """A boolean support of any shape, starting out as a centered box that fills 1/initial_oversampling of each axis."""
+    def __init__(self, shape, initial_oversampling=1.75):
+        array = np.zeros(shape, dtype="?")
+        corners = [int(round(n * (1 - 1 / initial_oversampling) / 2)) for n in array.shape]
+        array[tuple(slice(c, n - c) for c, n in zip(corners, array.shape))] = True
+        self.array = array
+
+    @property
+    def array(self):
+        return self._array
+
+    @array.setter
+    def array(self, value):
+        self._array = value
+        self.changed()
+
+    def changed(self):
+        """Bring the bounding window up to date. Call this after changing the array in place."""
+        self.window = Window(self._array, ndim=self._array.ndim)
+
+    def shrinkwrap(self, image, sigma=1.0, threshold=0.1, method="auto", scratch=None):
+        """
+        Threshold the blurred amplitude of an image into the support. A real array the shape of the image can be given
+        as scratch space for the amplitude, which saves allocating one (for a large volume, that's one less at peak).
+        """
+        # Wrapped boundaries make this independent of whether the image is in centered or unshifted (FFT) order.
+        amplitude = np.abs(image) if scratch is None else np.abs(image, out=scratch)
+        blurred = ut.gaussian_blur(amplitude, sigma, method)
+        ut.threshold(blurred, threshold, out=self._array)
+        self.changed()
 
     def where(self, where_true, where_false):
         return np.where(self.array, where_true, where_false)
 
 
+class Support2D(Support):
+    def __init__(self, size, initial_oversampling=1.75):
+        """A support for a size x size image, or a (rows, cols) shape."""
+        shape = (size, size) if np.ndim(size) == 0 else tuple(size)
+        super().__init__(shape, initial_oversampling)
+
+
+class Support3D(Support):
+    def __init__(self, shape, initial_oversampling=1.75):
+        """A support for a volume: a cube of side `shape`, or a (depth, rows, cols) shape."""
+        shape = (shape,) * 3 if np.ndim(shape) == 0 else tuple(shape)
+        super().__init__(shape, initial_oversampling)
+
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
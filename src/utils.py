@@ -1,21 +1,159 @@
-import tkinter as tk
+import functools
+import itertools
+import os
 
 import numpy as np
-from matplotlib import colors
-import scipy.ndimage as ndi
+import scipy.fft as sfft
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+
+FFT_BACKENDS = ["numpy", "scipy"] + (["pyfftw"] if pyfftw is not None else [])
+FFT_BACKEND = "pyfftw" if pyfftw is not None else "scipy"
+FFT_WORKERS = os.cpu_count() or 1
+# Real and complex working dtypes for each precision mode. Single precision halves the memory traffic of every step.
+PRECISIONS = {"double": (np.float64, np.complex128), "single": (np.float32, np.complex64)}
+PRECISION = "double"
+# Above this sigma, blurring by multiplying with a Gaussian transfer function beats direct convolution, whose cost grows
+# with the kernel width. Below it, the continuous transfer function is also a poor match for the sampled kernel.
+FOURIER_BLUR_MIN_SIGMA = 2.0
+SIMD_ALIGNMENT = 64
+# Sizes whose only prime factors are these run through the fastest FFT code paths of every backend
+FFT_FACTORS = (2, 3, 5)
+
+
+def empty_aligned(shape, dtype=np.complex128, alignment=SIMD_ALIGNMENT):
+    """Allocate an uninitialized array whose data pointer is aligned for SIMD loads."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+class FFTEngine:
+    """
+    Planned forward and inverse FFTs for a fixed array shape and dtype.
+
+    Transforms are done in unshifted (FFT) order, i.e. with the zero frequency in the corner. Results are written into
+    `out` when given, so callers that keep their own preallocated buffers never need a fresh array per transform.
+    """
+    def __init__(self, shape, dtype=np.complex128, backend=None, workers=None, axes=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.backend = FFT_BACKEND if backend is None else backend
+        self.workers = FFT_WORKERS if workers is None else workers
+        self.axes = tuple(range(len(self.shape))) if axes is None else tuple(axes)
+        if self.backend not in FFT_BACKENDS:
+            raise ValueError(f"Unknown or unavailable FFT backend '{self.backend}' (available: {FFT_BACKENDS})")
+
+        if self.backend == "pyfftw":
+            # FFTW plans are bound to a pair of aligned arrays; other arrays are swapped in on each call.
+            self.buffer_in = pyfftw.empty_aligned(self.shape, self.dtype)
+            self.buffer_out = pyfftw.empty_aligned(self.shape, self.dtype)
+            kwargs = {"axes": self.axes, "threads": self.workers, "flags": ("FFTW_MEASURE",)}
+            self._fwd = pyfftw.FFTW(self.buffer_in, self.buffer_out, direction="FFTW_FORWARD", **kwargs)
+            self._inv = pyfftw.FFTW(self.buffer_in, self.buffer_out, direction="FFTW_BACKWARD", **kwargs)
+
+    def empty(self):
+        """Allocate an aligned array that can be used as an input or output buffer for this engine."""
+        return empty_aligned(self.shape, self.dtype)
+
+    def forward(self, arr, out=None):
+        return self._transform(arr, out, inverse=False)
+
+    def inverse(self, arr, out=None):
+        return self._transform(arr, out, inverse=True)
+
+    def _transform(self, arr, out, inverse):
+        if self.backend == "pyfftw":
+            plan = self._inv if inverse else self._fwd
+            if out is None:
+                out = self.empty()
+            try:
+                if out is arr:
+                    raise ValueError("The plans are out-of-place")
+                plan(arr, out)
+            except ValueError:
+                # The output array doesn't match the plan's alignment/strides, so go through the internal buffer.
+                plan(arr, self.buffer_out)
+                np.copyto(out, self.buffer_out)
+            return out
+        if self.backend == "scipy" and out is not None:
+            # Transform a copy in place: with overwrite_x, pocketfft writes its output over its input, so no result
+            # array is allocated. (The same works with out as the input, for a fully in-place transform.)
+            if out is not arr:
+                np.copyto(out, arr)
+            func = sfft.ifftn if inverse else sfft.fftn
+            result = func(out, axes=self.axes, workers=self.workers, overwrite_x=True)
+            if not np.may_share_memory(result, out):
+                np.copyto(out, result)
+            return out
+        if self.backend == "scipy":
+            func = sfft.ifftn if inverse else sfft.fftn
+            result = func(arr, axes=self.axes, workers=self.workers)
+        else:
+            func = np.fft.ifftn if inverse else np.fft.fftn
+            result = func(arr, axes=self.axes)
+        if out is None:
+            return result
+        np.copyto(out, result)
+        return out
+
+
+@functools.lru_cache(maxsize=16)
+def get_engine(shape, dtype=np.complex128, backend=None, axes=None):
+    """Return a cached FFTEngine, so that plans and buffers are only built once per shape."""
+    return FFTEngine(tuple(shape), dtype, backend, axes=axes)
+
+
+def set_fft_backend(backend, workers=None):
+    """Select the FFT backend (and thread count) used by engines created from now on."""
+    global FFT_BACKEND, FFT_WORKERS
+    if backend not in FFT_BACKENDS:
+        raise ValueError(f"Unknown or unavailable FFT backend '{backend}' (available: {FFT_BACKENDS})")
+    FFT_BACKEND = backend
+    if workers is not None:
+        FFT_WORKERS = workers
+    get_engine.cache_clear()
+
+
+def set_precision(precision):
+    """Select the precision used by default from now on: "double" (float64/complex128) or "single" (float32/complex64)"""
+    global PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' (available: {list(PRECISIONS)})")
+    PRECISION = precision
+
+
+def dtypes(precision=None):
+    """Return the (real, complex) dtypes for a precision mode, or for the current default."""
+    precision = PRECISION if precision is None else precision
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' (available: {list(PRECISIONS)})")
+    return tuple(np.dtype(d) for d in PRECISIONS[precision])
 
 
 def fft(arr, modulus=False):
     """Perform a correctly shifted fast Fourier transform"""
+    arr = np.asarray(arr)
+    engine = get_engine(arr.shape, np.result_type(arr.dtype, np.complex64))
+    result = np.fft.fftshift(engine.forward(np.fft.ifftshift(arr)))
     if modulus:
-        return np.abs(np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(arr))))**2
-    return np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(arr)))
+        return np.abs(result)**2
+    return result
 
 
 def ifft(arr, modulus=False):
+    arr = np.asarray(arr)
+    engine = get_engine(arr.shape, np.result_type(arr.dtype, np.complex64))
+    result = np.fft.fftshift(engine.inverse(np.fft.ifftshift(arr)))
     if modulus:
-        return np.abs(np.fft.fftshift(np.fft.ifftn(np.fft.ifftshift(arr))))**2
-    return np.fft.fftshift(np.fft.ifftn(np.fft.ifftshift(arr)))
+        return np.abs(result)**2
+    return result
 
 
 def log(comp_arr):
@@ -26,23 +164,111 @@ def log(comp_arr):
 
 
 def normalize(arr):
-    return (arr - np.min(arr)) / (np.max(arr) - np.min(arr))
+    lo, hi = np.min(arr), np.max(arr)
+    out = np.subtract(arr, lo)
+    out /= hi - lo
+    return out
+
+
+def threshold(arr, rel_threshold, out=None, ndim=None):
+    """
+    Equivalent to normalize(arr) > rel_threshold, but done as one comparison pass with no normalized temporary.
+
+    If ndim is given, each array along the leading axes is normalized separately over its last ndim axes.
+    """
+    axes = None if ndim is None else tuple(range(-ndim, 0))
+    lo = np.min(arr, axis=axes, keepdims=True)
+    hi = np.max(arr, axis=axes, keepdims=True)
+    return np.greater(arr, lo + rel_threshold * (hi - lo), out=out)
+
+
+def make_gaussian_transfer(shape, sigma, dtype=np.float64, rfft=True):
+    """
+    The transfer function of a Gaussian blur on an rfftn grid of the given (real-space) shape, or a full fftn grid. The
+    result is read-only.
+    """
+    last = np.fft.rfftfreq(shape[-1]) if rfft else np.fft.fftfreq(shape[-1])
+    freqs = [np.fft.fftfreq(n) for n in shape[:-1]] + [last]
+    k2 = sum(np.meshgrid(*[f**2 for f in freqs], indexing="ij", sparse=True))
+    # In place, so a volume's transfer function doesn't need several full-size float64 temporaries
+    k2 *= -2 * np.pi**2 * sigma**2
+    transfer = np.exp(k2, out=k2).astype(dtype, copy=False)
+    transfer.flags.writeable = False
+    return transfer
+
+
+@functools.lru_cache(maxsize=32)
+def gaussian_transfer(shape, sigma, dtype=np.float64, rfft=True):
+    """make_gaussian_transfer, cached by (shape, sigma, dtype, rfft) with LRU eviction, so that shrinkwraps reuse it."""
+    return make_gaussian_transfer(shape, sigma, dtype, rfft)
+
+
+def gaussian_blur(arr, sigma, method="auto", ndim=None):
+    """
+    Gaussian blur of a real array with periodic (wrapped) boundaries, over its last ndim axes (default: all of them).
+
+    The "spatial" method convolves directly, while "fourier" multiplies the real FFT by a cached transfer function, so
+    its cost doesn't depend on sigma. "auto" chooses between them based on sigma.
+    """
+    ndim = arr.ndim if ndim is None else ndim
+    if method == "auto":
+        method = "fourier" if sigma >= FOURIER_BLUR_MIN_SIGMA else "spatial"
+    if method == "spatial":
+        import scipy.ndimage as ndi
+        return ndi.gaussian_filter(arr, [0] * (arr.ndim - ndim) + [sigma] * ndim, mode="wrap")
+    if method != "fourier":
+        raise ValueError(f"Unknown blur method '{method}'")
+    axes = tuple(range(-ndim, 0))
+    spectrum = sfft.rfftn(arr, axes=axes, workers=FFT_WORKERS)
+    spectrum *= gaussian_transfer(arr.shape[-ndim:], float(sigma), arr.dtype)
+    return sfft.irfftn(spectrum, s=arr.shape[-ndim:], axes=axes, workers=FFT_WORKERS)
+
+
+def roll(arr, shifts, out):
+    """np.roll over every axis, written into out (which mustn't overlap arr) instead of a new array."""
+    parts = []
+    for n, shift in zip(arr.shape, shifts):
+        shift %= n
+        # (source, destination) slices of the two parts of the axis
+        parts.append([(slice(0, n - shift), slice(shift, n)), (slice(n - shift, n), slice(0, shift))])
+    for part in itertools.product(*parts):
+        out[tuple(dst for _, dst in part)] = arr[tuple(src for src, _ in part)]
+    return out
 
 
 def pad_to_size(arr, n_new):
-    # Assuming square array
-    n_old = arr.shape[0]
-    pad = (n_new - n_old) // 2
-    if 2*pad + n_old == n_new:
-        return np.pad(arr, ((pad, pad), (pad, pad)))
-    elif 2*pad + n_old == n_new - 1:
-        return np.pad(arr, ((pad, pad+1), (pad, pad+1)))
-    else:
-        raise IndexError(f'Error padding to desired size: N_new={n_new}, N_old={n_old}, N_pad={pad}, '
-                         f'N_out={2 * pad + n_old}')
+    """
+    Zero-pad a centered array to a new shape: n_new is one size for every axis, or a shape. The center pixel (n//2)
+    stays the center pixel, whatever the parities of the sizes.
+    """
+    shape = tuple(np.broadcast_to(n_new, (arr.ndim,)).tolist())
+    if any(new < old for new, old in zip(shape, arr.shape)):
+        raise IndexError(f'Error padding to desired size: N_new={shape}, N_old={arr.shape}')
+    pads = [(new // 2 - old // 2, new - old - (new // 2 - old // 2)) for new, old in zip(shape, arr.shape)]
+    return np.pad(arr, pads)
+
+
+def fft_size(n, factors=FFT_FACTORS):
+    """The smallest even size >= n whose only prime factors are the given ones."""
+    size = max(n + n % 2, 2)
+    while True:
+        rest = size
+        for factor in factors:
+            while rest % factor == 0:
+                rest //= factor
+        if rest == 1:
+            return size
+        size += 2
+
+
+def pad_to_fft_size(arr, factors=FFT_FACTORS):
+    """Zero-pad a centered array up to the next fft_size() along every axis, or return it as is if it already is."""
+    shape = tuple(fft_size(n, factors) for n in arr.shape)
+    return arr if shape == arr.shape else pad_to_size(arr, shape)
 
 
 def complex_composite_image(comp_img, dark_background=False):
+    from matplotlib import colors
     amp = normalize(np.abs(comp_img))
     phi = normalize(np.angle(comp_img))
     one = np.ones_like(amp)
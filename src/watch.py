@@ -0,0 +1,203 @@
+"""
+Watching a folder for new data during acquisition.
+
+New files are picked up with inotify on Linux (through ctypes, no extra dependencies), or by polling the folder
+elsewhere. A background thread reads their frames into an accumulator as they arrive, and hands the batch over at most
+once every `min_interval` seconds, so a fast detector doesn't swap the data under the solver on every frame.
+
+Usage:
+    python -m src.watch /path/to/acquisition --output live.npy
+"""
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import src.accumulate as accumulate
+import src.readers as readers
+
+
+SUFFIXES = {".tif", ".tiff", ".npy", ".png"} | readers.HDF5_SUFFIXES
+POLL_INTERVAL = 0.5
+MIN_INTERVAL = 1.0
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class InotifyWatcher:
+    """Reports files in a directory once they've been written and closed (or moved in), using Linux's inotify."""
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.directory = Path(directory)
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"Can't watch {self.directory}")
+
+    def new_files(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        buf = os.read(self.fd, 1 << 16)
+        names = []
+        offset = 0
+        while offset < len(buf):
+            _, _, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            names.append(buf[offset:offset + length].rstrip(b"\0").decode(errors="surrogateescape"))
+            offset += length
+        return [self.directory / name for name in names if name]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports new files by listing the directory, once their size has stopped changing between two scans."""
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = Path(directory)
+        self.interval = interval
+        self._seen = {path.name for path in self.directory.iterdir()}
+        self._sizes = {}
+
+    def new_files(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.name in self._seen or not entry.is_file():
+                continue
+            size = entry.stat().st_size
+            if self._sizes.get(entry.name) == size:
+                found.append(Path(entry.path))
+                self._seen.add(entry.name)
+                del self._sizes[entry.name]
+            else:
+                self._sizes[entry.name] = size
+        return sorted(found)
+
+    def close(self):
+        pass
+
+
+def watcher(directory, use_inotify=True):
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError):
+            pass  # not Linux, or out of watches
+    return PollingWatcher(directory)
+
+
+class WatchThread(threading.Thread):
+    """
+    Reads every new data file in a directory into an accumulator on a background thread.
+
+    Call take() periodically: it returns the frames accumulated since the last handover (a FrameAccumulator), or None
+    if there's nothing new yet or the last handover was less than min_interval seconds ago.
+    """
+    def __init__(self, directory, min_interval=MIN_INTERVAL, use_inotify=True, suffixes=SUFFIXES):
+        super().__init__(daemon=True)
+        self.directory = Path(directory)
+        self.min_interval = min_interval
+        self.suffixes = suffixes
+        self.watcher = watcher(directory, use_inotify)
+        self.n_files = 0
+        self.failed = []  # (filepath, error) for files that couldn't be read
+        self._lock = threading.Lock()
+        self._pending = accumulate.FrameAccumulator()
+        self._last_take = 0.0
+        self._stopping = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopping.is_set():
+                for filepath in self.watcher.new_files(timeout=0.2):
+                    if filepath.suffix.lower() in self.suffixes:
+                        self._read(filepath)
+        finally:
+            self.watcher.close()
+
+    def _read(self, filepath):
+        try:
+            for frame in readers.open_frames(filepath):
+                frame = np.asarray(frame)
+                with self._lock:
+                    self._pending.add(frame)
+        except Exception as err:
+            self.failed.append((filepath, err))
+            return
+        self.n_files += 1
+
+    def take(self):
+        now = time.monotonic()
+        if now - self._last_take < self.min_interval:
+            return None
+        with self._lock:
+            if self._pending.n_frames == 0:
+                return None
+            batch, self._pending = self._pending, accumulate.FrameAccumulator()
+        self._last_take = now
+        return batch
+
+    def stop(self):
+        self._stopping.set()
+
+
+if __name__ == "__main__":
+    from src.diffraction import LoadData
+    from src.phasing import Solver
+
+    parser = argparse.ArgumentParser(description="Phase data as it's acquired, refining as new frames arrive.")
+    parser.add_argument("directory", help="folder the detector writes frames to")
+    parser.add_argument("-r", "--recipe", default="HIO:50, SW every 1", help="recipe run between data updates")
+    parser.add_argument("-i", "--interval", type=float, default=MIN_INTERVAL, help="minimum seconds between updates")
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("-p", "--precision", default=None)
+    parser.add_argument("--poll", action="store_true", help="poll the folder instead of using inotify")
+    parser.add_argument("-o", "--output", default=None, help="save the object here (.npy) after every update")
+    args = parser.parse_args()
+
+    thread = WatchThread(args.directory, args.interval, use_inotify=not args.poll)
+    thread.start()
+    print(f"Watching {args.directory} ({type(thread.watcher).__name__}), Ctrl-C to stop")
+    data = LoadData(None, args.precision)
+    solver = None
+    try:
+        while True:
+            batch = thread.take()
+            if batch is not None:
+                if solver is None:
+                    # The first frames set the center (and the shape) that everything after them is merged into
+                    data.use_frames(batch)
+                    solver = Solver(data.preprocess(), seed=args.seed, precision=args.precision)
+                else:
+                    data.add_frames(batch)
+                    solver.set_diffraction(data.preprocess())
+                print(f"{data.n_images} frames from {thread.n_files} files")
+            if solver is None:
+                time.sleep(0.1)
+                continue
+            solver.run_recipe(args.recipe)
+            print(f"  Fourier error {solver.fourier_error:.4g}", end="\r")
+            if batch is not None and args.output is not None:
+                np.save(args.output, solver.ds_image)
+    except KeyboardInterrupt:
+        pass
+    thread.stop()
+    for filepath, err in thread.failed:
+        print(f"Couldn't read {filepath}: {err}")
+    if solver is not None and args.output is not None:
+        np.save(args.output, solver.ds_image)
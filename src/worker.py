@@ -0,0 +1,121 @@
+"""
+Background solver thread for the live GUI.
+
+The thread iterates as fast as the solver allows and hands snapshots of the object to the GUI through a triple buffer:
+the worker fills the back buffer and swaps it with the "ready" one, and the GUI swaps the ready buffer with the one it is
+drawing from. Neither side ever waits for the other, and a buffer is never written while it is being drawn.
+"""
+import threading
+
+import numpy as np
+
+from src.recipe import OSS_STAGES
+
+
+# The number of iterations over which OSS narrows its filter in a live run, which has no set length (see
+# phasing.oversampling_smoothness). As in a recipe, the filter narrows in OSS_STAGES steps, so that only a few
+# different filters are ever computed.
+OSS_ITERATIONS = 1000
+
+
+class SolverThread(threading.Thread):
+    def __init__(self, solver=None, beta=0.9, sigma=2.0, threshold=0.2, algorithm="hio"):
+        super().__init__(daemon=True)
+        # Held for the duration of every iteration. Anything else that touches the solver should hold it as well.
+        self.lock = threading.Lock()
+        # Replaced as a whole, so the worker never sees a partial update
+        self.params = (algorithm, beta, sigma, threshold)
+        self.iterations = 0
+        self.autosave = None  # called as autosave(solver, iterations) after every iteration, e.g. a checkpointer
+        self.error = None  # the exception that stopped the iterations, if any, for the GUI to pick up
+        self._oss_start = None  # the iteration OSS was switched on at
+        self._running = threading.Event()
+        self._quit = False
+        self._swap_lock = threading.Lock()
+        self._fresh = False
+        # The solver can also be handed over later (with set_solver), e.g. once the data have been loaded
+        self.solver = None
+        if solver is not None:
+            self.set_solver(solver)
+
+    def set_solver(self, solver):
+        with self.lock:
+            self.solver = solver
+            self.iterations = 0
+            self._oss_start = None
+            self.error = None
+            self._buffers = [np.empty_like(solver._ds) for _ in range(3)]
+            self._back, self._ready, self._front = self._buffers
+            self._fresh = False
+
+    @property
+    def is_running(self):
+        return self._running.is_set()
+
+    def resume(self):
+        self.error = None
+        self._running.set()
+
+    def pause(self):
+        """Stop iterating, and wait until the iteration in progress (if any) has finished."""
+        self._running.clear()
+        with self.lock:
+            pass
+
+    def quit(self):
+        self._quit = True
+        self._running.set()
+
+    def run(self):
+        while True:
+            self._running.wait()
+            if self._quit:
+                return
+            with self.lock:
+                if not self._running.is_set():
+                    continue
+                algorithm, beta, sigma, threshold = self.params
+                try:
+                    self.solver.iterate(beta, algorithm=algorithm, **self._algorithm_params(algorithm))
+                    self.solver.shrinkwrap(sigma, threshold)
+                except Exception as err:  # e.g. an algorithm this solver can't run
+                    # Stop rather than die, so that the GUI can report it and carry on
+                    self.error = err
+                    self._running.clear()
+                    continue
+                self.iterations += 1
+                if self.autosave is not None:
+                    self.autosave(self.solver, self.iterations)
+                if not self._fresh:
+                    # Only copy out a snapshot once the GUI has picked up the previous one.
+                    self._publish()
+
+    def _algorithm_params(self, algorithm):
+        """OSS anneals over OSS_ITERATIONS from when it was chosen; the other algorithms take no extra parameters."""
+        if algorithm != "oss":
+            self._oss_start = None
+            return {}
+        if self._oss_start is None:
+            self._oss_start = self.iterations
+        stage = min(OSS_STAGES - 1, (self.iterations - self._oss_start) * OSS_STAGES // OSS_ITERATIONS)
+        return {"progress": stage / (OSS_STAGES - 1)}
+
+    def _publish(self):
+        np.copyto(self._back, self.solver._ds)
+        with self._swap_lock:
+            self._back, self._ready = self._ready, self._back
+            self._fresh = True
+
+    def latest(self, shifted=True):
+        """
+        Return the newest snapshot of the object, or None if there's nothing new since the last call.
+
+        The snapshot is centered, unless shifted=False: then it's the buffer itself, in unshifted (FFT) order, which
+        stays untouched until the next call.
+        """
+        with self._swap_lock:
+            if not self._fresh:
+                return None
+            self._front, self._ready = self._ready, self._front
+            self._fresh = False
+        return np.fft.fftshift(self._front) if shifted else self._front
@@ -0,0 +1,3 @@
+from pathlib import Path
+import sys
+sys.path.append(f"{Path(__file__).parents[1]}")  # so that src is importable however pytest is run
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.accumulate import FrameAccumulator
+
+
+def frames(n, seed=0):
+    return np.random.default_rng(seed).poisson(50, (n, 16, 12)).astype(float)
+
+
+def test_statistics():
+    stack = frames(7)
+    acc = FrameAccumulator()
+    for frame in stack:
+        acc.add(frame)
+    assert acc.n_frames == 7
+    assert np.allclose(acc.sum, stack.sum(axis=0))
+    assert np.allclose(acc.mean, stack.mean(axis=0))
+    assert np.allclose(acc.variance, stack.var(axis=0, ddof=1))
+    assert np.array_equal(acc.max, stack.max(axis=0))
+
+
+def test_merge():
+    stack = frames(9, seed=1)
+    first, second = FrameAccumulator(), FrameAccumulator()
+    for frame in stack[:4]:
+        first.add(frame)
+    for frame in stack[4:]:
+        second.add(frame)
+    first.merge(second)
+    assert first.n_frames == 9
+    assert np.allclose(first.mean, stack.mean(axis=0))
+    assert np.allclose(first.variance, stack.var(axis=0, ddof=1))
+    assert np.array_equal(first.max, stack.max(axis=0))
+
+
+def test_keeps_no_working_buffers():
+    acc = FrameAccumulator()
+    for frame in frames(3):
+        acc.add(frame)
+    arrays = [value for value in vars(acc).values() if isinstance(value, np.ndarray)]
+    assert len(arrays) == 3  # the sum, the squared deviations and the maximum
+
+
+@pytest.mark.parametrize("shape, ndim", [((16, 12), 2), ((16, 12, 3), 2), ((10, 12, 8), 3)])
+def test_hot_pixels(shape, ndim):
+    stack = np.random.default_rng(2).poisson(50, (5,) + shape).astype(float)
+    hot_index = (4, 5, 2)[:ndim]
+    stack[(slice(None),) + hot_index] += 1000  # in every color channel
+    acc = FrameAccumulator()
+    for frame in stack:
+        acc.add(frame)
+    hot = acc.hot_pixels(ndim=ndim)
+    assert hot.shape == shape[:ndim]
+    assert list(zip(*np.nonzero(hot))) == [hot_index]
+
+
+def test_hot_pixels_rejects_other_shapes():
+    acc = FrameAccumulator()
+    acc.add(np.ones((4, 4, 4, 3)))
+    with pytest.raises(ValueError):
+        acc.hot_pixels(ndim=2)
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+import src.binning as binning
+
+
+@pytest.mark.parametrize("shape", [(8, 8), (10, 8), (9, 10), (7, 5)])
+def test_block_mean_partial(shape):
+    image = np.arange(np.prod(shape), dtype=float).reshape(shape)
+    binned = binning.block_mean(image, 4, edge="partial")
+    assert binned.shape == tuple(-(-n // 4) for n in shape)
+    # Every block, partial or not, is the mean of the pixels it holds
+    for i in range(binned.shape[0]):
+        for j in range(binned.shape[1]):
+            assert binned[i, j] == pytest.approx(image[4 * i:4 * i + 4, 4 * j:4 * j + 4].mean())
+
+
+def test_block_mean_partial_of_constant():
+    assert np.allclose(binning.block_mean(np.ones((10, 8)), 4, edge="partial"), 1)
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.diffraction import LoadData
+
+
+@pytest.mark.parametrize("size", [400, 1100])
+def test_rgb_frame(tmp_path, size):
+    rows, cols = np.indices((size, size))
+    peak = (size // 2 + 7, size // 2 - 12)
+    pattern = 250 * np.exp(-((rows - peak[0]) ** 2 + (cols - peak[1]) ** 2) / 50)
+    filepath = tmp_path / "rgb.png"
+    Image.fromarray(np.stack([pattern] * 3, axis=-1).astype(np.uint8)).save(filepath)
+    data = LoadData(str(filepath))
+    assert tuple(data.ctr) == peak
+    assert data.image.ndim == 2
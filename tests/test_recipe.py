@@ -0,0 +1,34 @@
+import pytest
+
+from src.recipe import RecipeError, compile_recipe, execute, parse_recipe
+
+
+def test_repeat():
+    assert parse_recipe("HIO:50, repeat 3")[-1] == ("REPEAT", 3, None, {})
+
+
+@pytest.mark.parametrize("text", ["HIO:50, repeat 0", "HIO:50, repeat -2", "HIO:50, repeat", "HIO:50, repeat x",
+                                  "HIO:50, SW every 0", "HIO:50 beta=x", "SW sigma=", "BLUR sigma=1=2"])
+def test_syntax_errors(text):
+    with pytest.raises(RecipeError):
+        parse_recipe(text)
+
+
+class Counter:
+    """Stands in for a Solver, counting the iterations and the shrinkwraps."""
+    def __init__(self):
+        self.iterations = self.shrinkwraps = 0
+
+    def iterate(self, error=False, algorithm="hio", **params):
+        self.iterations += 1
+
+    def shrinkwrap(self, sigma, threshold):
+        self.shrinkwraps += 1
+
+
+@pytest.mark.parametrize("algorithm", ["HIO", "OSS"])
+@pytest.mark.parametrize("every, expected", [(20, 5), (7, 14), (1, 100)])
+def test_shrinkwrap_every(algorithm, every, expected):
+    solver = Counter()
+    assert execute(solver, compile_recipe(f"{algorithm}:100, SW every {every}")) == 100
+    assert solver.shrinkwraps == expected